@@ -2,21 +2,50 @@ import os
 import sys
 from flask import Flask, request, jsonify, abort, redirect
 from flask_cors import CORS
+from flask_migrate import Migrate
 from jsonschema.exceptions import ValidationError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
-from models import setup_db, Movie, Actor
+from models import db, setup_db, get_total, update_links, Movie, Actor
 from schema_utils import get_schemas, schema_validator
-from auth import AuthError, requires_auth
+from query_utils import get_page, get_item, filter_query, \
+    get_fields_args, get_pagination_args, format_row, format_rows, \
+    get_by_ids, get_ids_args, get_items, project
+from export import export_rows
+from bulk import bulk_create
+from search import search
+from graph import get_costars, find_path
+from stats import get_stats
+from cache import cached, get_cache
+from etags import conditional
+from auth import AuthError, requires_auth, setup_auth
+from json_provider import JSONProvider
+from compression import setup_compression
+from db_pool import get_pool_metrics
+from db_routing import setup_replicas
+from unit_of_work import setup_unit_of_work
 
-ITEMS_PER_PAGE = 10
 SCHEMAS = get_schemas()
 
 
 def create_app(test_config=None):
-    """Flask App for the Casting Agency API"""
+    """Flask App for the Casting Agency API
+
+    Creating the app opens no connections unless DB_CREATE_SCHEMA is
+    set, so a server may create it before forking its workers.
+    """
     app = Flask(__name__)
     app.config.from_object(os.environ['APP_SETTINGS'])
+    app.json = JSONProvider(app)
+    setup_auth(app)
     setup_db(app)
+    # Adds the `flask db` commands that run the migrations
+    Migrate(app, db)
+    setup_replicas(app)
+    setup_compression(app)
+    # Registered after compression, so a failed commit is raised before
+    # the body is compressed
+    setup_unit_of_work(app)
     CORS(app)
 
     @app.route('/')
@@ -31,8 +60,27 @@ def create_app(test_config=None):
             'status': 'available',
         })
 
+    @app.route('/api/metrics')
+    @requires_auth('get:metrics', test_config)
+    def metrics(payload):
+        """Returns the counters of the response cache, of the DB
+        connection pool and of the replica router of this process.
+
+        Requires the 'get:metrics' permission in the JWT Bearer
+        authentication.
+        """
+        router = app.extensions['db_router']
+        return jsonify({
+            'success': True,
+            'responseCache': get_cache().get_metrics(),
+            'dbPool': get_pool_metrics(db.engine),
+            'dbReplicas': router.get_metrics() if router.engines else None
+        })
+
     @app.route('/api/actors')
     @requires_auth('get:actors', test_config)
+    @conditional('actor')
+    @cached('actor')
     def get_actors(payload):
         """Fetches all rows from the Actor table.
 
@@ -43,26 +91,44 @@ def create_app(test_config=None):
 
         Returns:
             A JSON representation of all Actors in the DB paginated at
-            10 per page. The query string 'page' can be added to the URI
-            to return the next set of 10.
+            10 per page ordered by ID. The query string 'page' can be added
+            to the URI to return the next set, and 'per_page' to change the
+            page size up to MAX_ITEMS_PER_PAGE. The query string 'sort'
+            changes the order, and 'cursor' switches to keyset pagination
+            with the cursor for the next page returned in 'next'. The query
+            string 'fields' limits the attributes returned for each row.
+            The query strings 'gender', 'age_min' and 'age_max' filter the
+            Actors, and 'totalActors' counts the matching Actors.
+            The query string 'ids' instead fetches the Actors with the
+            given IDs in that order, listing unknown IDs in 'notFound'.
         """
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * ITEMS_PER_PAGE
-        end = start + ITEMS_PER_PAGE
-
-        actors = Actor.query.all()
-        formatted_actors = [actor.get_data() for actor in actors]
-        if start > len(formatted_actors):
-            abort(404)
-
-        return jsonify({
+        ids = get_ids_args()
+        if ids is not None:
+            actors, not_found = get_items(Actor, ids)
+            return jsonify({
+                'success': True,
+                'actors': actors,
+                'notFound': not_found
+            })
+
+        query, filtered = filter_query(Actor.query, Actor)
+        total_actors = query.count() if filtered else get_total(Actor)
+        actors, next_cursor = get_page(query, Actor, total_actors)
+
+        response = {
             'success': True,
-            'actors': formatted_actors[start:end],
-            'totalActors': len(formatted_actors)
-        })
+            'actors': actors,
+            'totalActors': total_actors
+        }
+        if 'cursor' in request.args:
+            response['next'] = next_cursor
+
+        return jsonify(response)
 
     @app.route('/api/movies')
     @requires_auth('get:movies', test_config)
+    @conditional('movie')
+    @cached('movie')
     def get_movies(payload):
         """Fetches all rows from the Movie table.
 
@@ -73,26 +139,244 @@ def create_app(test_config=None):
 
         Returns:
             A JSON representation of all Movies in the DB paginated at
-            10 per page. The query string 'page' can be added to the URI
-            to return the next set of 10.
+            10 per page ordered by ID. The query string 'page' can be added
+            to the URI to return the next set, and 'per_page' to change the
+            page size up to MAX_ITEMS_PER_PAGE. The query string 'sort'
+            changes the order, and 'cursor' switches to keyset pagination
+            with the cursor for the next page returned in 'next'. The query
+            string 'fields' limits the attributes returned for each row.
+            The query strings 'released_after' and 'released_before' filter
+            the Movies by date, and 'totalMovies' counts the matching Movies.
+            The query string 'ids' instead fetches the Movies with the
+            given IDs in that order, listing unknown IDs in 'notFound'.
+        """
+        ids = get_ids_args()
+        if ids is not None:
+            movies, not_found = get_items(Movie, ids)
+            return jsonify({
+                'success': True,
+                'movies': movies,
+                'notFound': not_found
+            })
+
+        query, filtered = filter_query(Movie.query, Movie)
+        total_movies = query.count() if filtered else get_total(Movie)
+        movies, next_cursor = get_page(query, Movie, total_movies)
+
+        response = {
+            'success': True,
+            'movies': movies,
+            'totalMovies': total_movies
+        }
+        if 'cursor' in request.args:
+            response['next'] = next_cursor
+
+        return jsonify(response)
+
+    @app.route('/api/actors/export')
+    @requires_auth('get:actors', test_config)
+    def export_actors(payload):
+        """Streams all rows from the Actor table as NDJSON.
+
+        Requires the 'get:actors' permission in the JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            One JSON representation of an Actor per line ordered by ID.
+            The query string 'fields' limits the attributes returned, and
+            'include=movieIds' adds the IDs of each Actor's Movies.
+        """
+        include = request.args.get('include', None)
+        if include not in (None, 'movieIds'):
+            abort(400)
+
+        return export_rows(Actor, 'movies', include)
+
+    @app.route('/api/movies/export')
+    @requires_auth('get:movies', test_config)
+    def export_movies(payload):
+        """Streams all rows from the Movie table as NDJSON.
+
+        Requires the 'get:movies' permission in the JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            One JSON representation of a Movie per line ordered by ID.
+            The query string 'fields' limits the attributes returned, and
+            'include=actorIds' adds the IDs of each Movie's Actors.
+        """
+        include = request.args.get('include', None)
+        if include not in (None, 'actorIds'):
+            abort(400)
+
+        return export_rows(Movie, 'actors', include)
+
+    @app.route('/api/search')
+    @requires_auth(['get:actors', 'get:movies'], test_config)
+    @cached('actor', 'movie')
+    def search_actors_and_movies(payload):
+        """Searches Actor names and Movie titles.
+
+        Requires the 'get:actors' and 'get:movies' permissions in the
+        JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            A JSON representation of the Actors and Movies best matching
+            the query string 'q', best match first and paginated at 10 per
+            page. The query string 'type' limits the results to 'actors'
+            or 'movies', and 'fields' applies to both.
         """
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * ITEMS_PER_PAGE
-        end = start + ITEMS_PER_PAGE
+        q = request.args.get('q', '').strip()
+        search_type = request.args.get('type', None)
+        if not q or search_type not in (None, 'actors', 'movies'):
+            abort(400)
+
+        page, per_page = get_pagination_args()
+        offset = (page - 1) * per_page
+        response = {'success': True}
+        for key, model in [('actors', Actor), ('movies', Movie)]:
+            if search_type in (None, key):
+                fields = get_fields_args(model)
+                rows = search(model, q, fields, per_page, offset)
+                response[key] = format_rows(model, rows, fields)
+
+        return jsonify(response)
+
+    @app.route('/api/actors/<int:actor_id>/costars')
+    @requires_auth('get:actors', test_config)
+    @cached('actor', 'movie_actors')
+    def get_actor_costars(payload, actor_id):
+        """Fetches the Actors who appeared in a Movie with an Actor.
+
+        Requires the 'get:actors' permission in the JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+            actor_id: The primary key for the Actor.
 
-        movies = Movie.query.all()
-        formatted_movies = [movie.get_data() for movie in movies]
-        if start > len(formatted_movies):
+        Returns:
+            A JSON representation of the co-stars with the number of
+            Movies shared with the Actor in 'sharedMovies', most shared
+            first and paginated at 10 per page. 'totalCostars' counts
+            the co-stars, and the query string 'fields' limits the
+            attributes returned for each co-star.
+        """
+        _, not_found = get_by_ids(
+            Actor.query.with_entities(Actor.id), Actor, [actor_id])
+        if not_found:
             abort(404)
 
+        costars = get_costars(actor_id)
+        page, per_page = get_pagination_args()
+        start = (page - 1) * per_page
+        if start > len(costars):
+            abort(404)
+        costars_page = costars[start:start + per_page]
+
+        fields = get_fields_args(Actor)
+        costar_ids = [costar_id for costar_id, _ in costars_page]
+        rows, _ = get_by_ids(project(Actor.query, Actor, fields, 'id'),
+                             Actor, costar_ids)
+        formatted_costars = []
+        for costar_id, shared_movies in costars_page:
+            if costar_id in rows:
+                costar = format_row(Actor, rows[costar_id], fields)
+                costar['sharedMovies'] = shared_movies
+                formatted_costars.append(costar)
+
         return jsonify({
             'success': True,
-            'movies': formatted_movies[start:end],
-            'totalMovies': len(formatted_movies)
+            'costars': formatted_costars,
+            'totalCostars': len(costars)
         })
 
+    @app.route('/api/graph/path')
+    @requires_auth(['get:actors', 'get:movies'], test_config)
+    @cached('actor', 'movie', 'movie_actors')
+    def get_costar_path(payload):
+        """Finds a shortest chain of co-stars between two Actors.
+
+        Requires the 'get:actors' and 'get:movies' permissions in the
+        JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            A JSON representation of the Actors from the query string
+            'from' to 'to' in 'actors' and the Movies linking them in
+            'movies', where the Actors at i and i + 1 both appear in the
+            Movie at i. 'degrees' counts the Movies, and is null with no
+            Actors or Movies if the Actors are not connected.
+        """
+        source_id = request.args.get('from', None, type=int)
+        target_id = request.args.get('to', None, type=int)
+        if source_id is None or target_id is None:
+            abort(400)
+
+        _, not_found = get_by_ids(Actor.query.with_entities(Actor.id),
+                                  Actor, [source_id, target_id])
+        if not_found:
+            abort(404)
+
+        path = find_path(source_id, target_id)
+        if path is None:
+            return jsonify({
+                'success': True,
+                'actors': [],
+                'movies': [],
+                'degrees': None
+            })
+
+        actor_ids, movie_ids = path
+        actors, _ = get_items(Actor, actor_ids)
+        movies, _ = get_items(Movie, movie_ids)
+
+        return jsonify({
+            'success': True,
+            'actors': actors,
+            'movies': movies,
+            'degrees': len(movie_ids)
+        })
+
+    @app.route('/api/stats')
+    @requires_auth(['get:actors', 'get:movies'], test_config)
+    def get_statistics(payload):
+        """Fetches aggregate statistics of the Actors and Movies.
+
+        Requires the 'get:actors' and 'get:movies' permissions in the
+        JWT Bearer authentication.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            A JSON representation of the Actors by gender and by age, and
+            the Movies by release year and by number of Actors. The
+            statistics are kept in memory, and the query string 'verify'
+            recomputes them from the DB and reports in 'consistent'
+            whether they matched.
+        """
+        verify = request.args.get('verify', 'false')
+        if verify not in ('true', 'false'):
+            abort(400)
+
+        response = get_stats(verify == 'true')
+        response['success'] = True
+
+        return jsonify(response)
+
     @app.route('/api/actors/<int:actor_id>')
     @requires_auth('get:actor-detail', test_config)
+    @conditional('movie', 'movie_actors', row=(Actor, 'actor_id'))
+    @cached('actor:{actor_id}', related='movies')
     def get_actor(payload, actor_id):
         """Fetches a row with actor_id from the Actor table.
 
@@ -104,19 +388,22 @@ def create_app(test_config=None):
             actor_id: The primary key for the Actor.
 
         Returns:
-            A JSON representation of the Actor with actor_id
+            A JSON representation of the Actor with actor_id. The query
+            string 'fields' limits the attributes returned.
         """
-        actor = Actor.query.get(actor_id)
+        actor = get_item(Actor, actor_id, 'movies')
         if actor is None:
             abort(404)
 
         return jsonify({
             'success': True,
-            'actor': actor.get_data_with_movies()
+            'actor': actor
         })
 
     @app.route('/api/movies/<int:movie_id>')
     @requires_auth('get:movie-detail', test_config)
+    @conditional('actor', 'movie_actors', row=(Movie, 'movie_id'))
+    @cached('movie:{movie_id}', related='actors')
     def get_movie(payload, movie_id):
         """Fetches a row with Movie_id from the Movie table.
 
@@ -128,15 +415,16 @@ def create_app(test_config=None):
             movie_id: The primary key for the Movie.
 
         Returns:
-            A JSON representation of the Movie with movie_id
+            A JSON representation of the Movie with movie_id. The query
+            string 'fields' limits the attributes returned.
         """
-        movie = Movie.query.get(movie_id)
+        movie = get_item(Movie, movie_id, 'actors')
         if movie is None:
             abort(404)
 
         return jsonify({
             'success': True,
-            'movie': movie.get_data_with_actors()
+            'movie': movie
         })
 
     @app.route('/api/actors', methods=['POST'])
@@ -201,6 +489,60 @@ def create_app(test_config=None):
             'created': new_movie.id
         }), 201
 
+    @app.route('/api/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors', test_config)
+    def create_actors(payload):
+        """Inserts many rows in the Actor table in one transaction.
+
+        Requires the 'post:actors' permission in the JWT Bearer authentication.
+        JSON request body must be a list of objects valid against the
+        post_actor.json schema.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            A JSON response with the ID of the created Actor or the
+            validation error for each item, and the number created. The
+            query string 'mode' set to 'partial' inserts the valid items
+            even if others are invalid, otherwise no Actor is created if
+            any item is invalid.
+        """
+        results, created = bulk_create(Actor, SCHEMAS['post_actor'])
+        status_code = 201 if created or not results else 400
+
+        return jsonify({
+            'success': status_code == 201,
+            'results': results,
+            'created': created
+        }), status_code
+
+    @app.route('/api/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies', test_config)
+    def create_movies(payload):
+        """Inserts many rows in the Movie table in one transaction.
+
+        Requires the 'post:movies' permission in the JWT Bearer authentication.
+        JSON request body must be a list of objects valid against the
+        post_movie.json schema.
+
+        Args:
+            payload: A validated JWT for the Casting Agency app.
+
+        Returns:
+            A JSON response with the ID of the created Movie or the
+            validation error for each item, and the number created. The
+            query string 'mode' works as for /api/actors/bulk.
+        """
+        results, created = bulk_create(Movie, SCHEMAS['post_movie'])
+        status_code = 201 if created or not results else 400
+
+        return jsonify({
+            'success': status_code == 201,
+            'results': results,
+            'created': created
+        }), status_code
+
     @app.route('/api/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors', test_config)
     @schema_validator(SCHEMAS['patch_actor'])
@@ -216,17 +558,29 @@ def create_app(test_config=None):
             actor_id: The primary key for the Actor.
 
         Returns:
-            An updated JSON representation of the Actor.
+            An updated JSON representation of the Actor with its Movies,
+            and the IDs of requested Movies that do not exist in
+            'notFound' when Movies are given. 'movies' replaces all of the
+            Actor's Movies, while 'addMovies' and 'removeMovies' link and
+            unlink only the given Movies without loading the others.
         """
-        actor_to_update = Actor.query.get(actor_id)
-        if actor_to_update is None:
-            abort(404)
-
         request_body = request.get_json()
         name = request_body.get('name', None)
         age = request_body.get('age', None)
         gender = request_body.get('gender', None)
         movie_ids = request_body.get('movies', None)
+        add_ids = request_body.get('addMovies', [])
+        remove_ids = request_body.get('removeMovies', [])
+
+        # Only replacing the Movies needs the current ones loaded
+        if movie_ids:
+            actor_to_update = Actor.get_with_movies(actor_id)
+        else:
+            actor_to_update = Actor.query.get(actor_id)
+        if actor_to_update is None:
+            abort(404)
+        if movie_ids and (add_ids or remove_ids):
+            abort(400)
 
         # Accept update for name, age, gender, or movies in the message body
         if name:
@@ -236,22 +590,26 @@ def create_app(test_config=None):
         if gender:
             actor_to_update.gender = gender
         if movie_ids:
-            movies = []
-            for id in movie_ids:
-                movie = Movie.query.get(id)
-                if movie is not None:
-                    movies.append(movie)
+            movies, not_found = get_by_ids(Movie.query, Movie, movie_ids)
             if len(movies) > 0:
-                actor_to_update.movies = movies
+                actor_to_update.movies = list(movies.values())
             else:
                 abort(422)
+        if add_ids or remove_ids:
+            movies, not_found = get_by_ids(
+                Movie.query.with_entities(Movie.id), Movie, add_ids)
+            update_links(Actor, actor_id, list(movies), remove_ids)
 
         actor_to_update.update()
 
-        return jsonify({
+        response = {
             'success': True,
-            'actor': actor_to_update.get_data_with_movies()
-        })
+            'actor': get_item(Actor, actor_id, 'movies')
+        }
+        if movie_ids or add_ids:
+            response['notFound'] = not_found
+
+        return jsonify(response)
 
     @app.route('/api/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies', test_config)
@@ -268,16 +626,28 @@ def create_app(test_config=None):
             movie_id: The primary key for the Movie.
 
         Returns:
-            An updated JSON representation of the Movie.
+            An updated JSON representation of the Movie with its Actors,
+            and the IDs of requested Actors that do not exist in
+            'notFound' when Actors are given. 'actors' replaces all of the
+            Movie's Actors, while 'addActors' and 'removeActors' link and
+            unlink only the given Actors without loading the others.
         """
-        movie_to_update = Movie.query.get(movie_id)
-        if movie_to_update is None:
-            abort(404)
-
         request_body = request.get_json()
         title = request_body.get('title', None)
         release_date = request_body.get('releaseDate', None)
         actor_ids = request_body.get('actors', None)
+        add_ids = request_body.get('addActors', [])
+        remove_ids = request_body.get('removeActors', [])
+
+        # Only replacing the Actors needs the current ones loaded
+        if actor_ids:
+            movie_to_update = Movie.get_with_actors(movie_id)
+        else:
+            movie_to_update = Movie.query.get(movie_id)
+        if movie_to_update is None:
+            abort(404)
+        if actor_ids and (add_ids or remove_ids):
+            abort(400)
 
         # Accept update for title, release date, or movies in the message body
         if title:
@@ -285,22 +655,26 @@ def create_app(test_config=None):
         if release_date:
             movie_to_update.release_date = release_date
         if actor_ids:
-            actors = []
-            for id in actor_ids:
-                actor = Actor.query.get(id)
-                if actor is not None:
-                    actors.append(actor)
+            actors, not_found = get_by_ids(Actor.query, Actor, actor_ids)
             if len(actors) > 0:
-                movie_to_update.actors = actors
+                movie_to_update.actors = list(actors.values())
             else:
                 abort(422)
+        if add_ids or remove_ids:
+            actors, not_found = get_by_ids(
+                Actor.query.with_entities(Actor.id), Actor, add_ids)
+            update_links(Movie, movie_id, list(actors), remove_ids)
 
         movie_to_update.update()
 
-        return jsonify({
+        response = {
             'success': True,
-            'movie': movie_to_update.get_data()
-        })
+            'movie': get_item(Movie, movie_id, 'actors')
+        }
+        if actor_ids or add_ids:
+            response['notFound'] = not_found
+
+        return jsonify(response)
 
     @app.route('/api/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors', test_config)
@@ -372,6 +746,15 @@ def create_app(test_config=None):
             'message': error.message
         }), 400
 
+    @app.errorhandler(400)
+    def bad_request_args(error):
+        """Handles errors for invalid query strings in the request"""
+        return jsonify({
+            'success': False,
+            'error': 400,
+            'message': 'Bad request'
+        }), 400
+
     @app.errorhandler(404)
     def not_found(error):
         """Handles errors for resources not found in the app"""
@@ -399,6 +782,15 @@ def create_app(test_config=None):
             'message': 'Unprocessable entity'
         }), 422
 
+    @app.errorhandler(PoolTimeoutError)
+    def service_unavailable(error):
+        """Handles requests that waited too long for a DB connection"""
+        return jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'Service unavailable'
+        }), 503, {'Retry-After': '1'}
+
     @app.errorhandler(500)
     def server_error(error):
         """Handles all other app exceptions"""
@@ -412,7 +804,5 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
@@ -1,15 +1,18 @@
-import os
 import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from flask import request
 from functools import wraps
-from jose import jwt
+from jose import jwk, jwt
+from jose.utils import base64url_decode
 from urllib.request import urlopen
 
-
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = os.environ['ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE']
-CLIENT_ID = os.environ['CLIENT_ID']
+# The Auth0 tenant and API, set by setup_auth
+AUTH0_DOMAIN = None
+ALGORITHMS = None
+API_AUDIENCE = None
 
 
 class AuthError(Exception):
@@ -25,6 +28,267 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+def read_jwks(url):
+    """Returns a function that reads the JWKS at a URL.
+
+    Any URL urlopen supports works, e.g. a file:// URL for local testing.
+
+    !!NOTE urlopen has a common certificate error described here:
+    https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
+    """
+    def read():
+        with urlopen(url, timeout=10) as response:
+            return json.loads(response.read())
+
+    return read
+
+
+def parse_jwks(jwks):
+    """Parses the RSA signing keys of a JWKS.
+
+    Returns:
+        A dictionary of (algorithm, jose Key) keyed by kid.
+    """
+    keys = {}
+    for key in jwks['keys']:
+        if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+            continue
+        algorithm = key.get('alg', 'RS256')
+        keys[key['kid']] = (algorithm, jwk.construct({
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key.get('use', 'sig'),
+            'n': key['n'],
+            'e': key['e']
+        }, algorithm))
+
+    return keys
+
+
+class JWKSCache(object):
+    """Caches the signing keys of a JWKS, parsed once per refresh.
+
+    The keys are refreshed once they are ttl seconds old. A token with an
+    unknown kid forces a refresh so rotated keys are picked up, but at
+    most once every min_refresh_interval seconds, so tokens with made-up
+    kids cannot flood the JWKS endpoint. Concurrent refreshes collapse
+    into a single fetch, and a failed refresh keeps the cached keys.
+
+    Attributes:
+        source: A function returning the JWKS as a dictionary.
+        ttl: The number of seconds the keys are used before a refresh.
+        min_refresh_interval: The minimum number of seconds between two
+                              fetches of the JWKS.
+        refresh_interval: The number of seconds between refreshes by a
+                          background thread, or 0 to refresh on demand.
+        fetches: The number of times the JWKS was fetched.
+        error: The exception of the last failed fetch, if any.
+        listeners: Functions called with the set of kids a refresh
+                   removed, e.g. to drop tokens signed with them.
+    """
+
+    def __init__(self, source, ttl=600, min_refresh_interval=30,
+                 refresh_interval=0):
+        self.source = source
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.refresh_interval = refresh_interval
+        self.fetches = 0
+        self.error = None
+        self.listeners = []
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def get_key(self, kid):
+        """Returns the (algorithm, Key) of a kid, refreshing if needed.
+
+        Returns:
+            The parsed key, or None if the JWKS has no key for the kid.
+
+        Raises:
+            AuthError: If the JWKS has never been fetched successfully.
+        """
+        self.start()
+        generation = self._generation
+        now = time.monotonic()
+        stale = self._fetched_at is None or now - self._fetched_at > self.ttl
+        throttled = self._attempted_at is not None and \
+            now - self._attempted_at < self.min_refresh_interval
+        if (stale or kid not in self._keys) and not throttled:
+            self.refresh(generation)
+
+        if self._fetched_at is None:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return self._keys.get(kid)
+
+    def refresh(self, generation=None):
+        """Fetches and parses the JWKS.
+
+        Args:
+            generation: The refresh count seen by the caller. If another
+                        refresh finished while waiting for the lock, this
+                        one is skipped.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            self._attempted_at = time.monotonic()
+            try:
+                self.fetches += 1
+                keys = parse_jwks(self.source())
+            except Exception as error:
+                self.error = error
+                return
+            finally:
+                self._generation += 1
+
+            removed = set(self._keys) - set(keys)
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.error = None
+        if removed:
+            for listener in self.listeners:
+                listener(removed)
+
+    def start(self):
+        """Starts the background refresher if enabled and not running.
+
+        It is started on first use rather than on import, so each process
+        forked by the server gets its own.
+        """
+        if not self.refresh_interval or (
+                self._thread is not None and self._thread.is_alive()):
+            return
+
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='jwks-refresh', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+
+class TokenCache(object):
+    """An LRU cache of verified JWT payloads keyed by token digest.
+
+    A token is only verified the first time it is seen. Its payload is
+    then kept until the token's exp, or for at most ttl seconds, along
+    with its permissions as a set. Only a SHA-256 digest of the token is
+    kept, so the token itself cannot be read back from memory.
+
+    Attributes:
+        max_entries: The number of payloads kept before the least
+                     recently used one is dropped. 0 disables the cache.
+        ttl: The maximum number of seconds a payload is kept, or 0 to
+             keep it until the token expires.
+        hits: The number of tokens found in the cache.
+        misses: The number of tokens that had to be verified.
+    """
+
+    def __init__(self, max_entries=4096, ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_digest(token):
+        """Returns the key of a token in the cache."""
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """Returns the (payload, permissions) of a token, or None."""
+        digest = self.get_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and time.time() < entry[3]:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[0], entry[1]
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def set(self, token, payload, kid):
+        """Caches the verified payload of a token signed with kid.
+
+        Returns:
+            The (payload, permissions) of the token.
+        """
+        permissions = frozenset(payload.get('permissions', ()))
+        expires = payload.get('exp')
+        if self.ttl:
+            expires = min(expires or float('inf'), time.time() + self.ttl)
+        if not self.max_entries or expires is None:
+            return payload, permissions
+
+        with self._lock:
+            self._entries[self.get_digest(token)] = (
+                payload, permissions, kid, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload, permissions
+
+    def invalidate(self, kids=None):
+        """Drops the payloads of tokens signed with kids, or all of them.
+
+        Called by the JWKSCache with the kids it stops trusting, so a
+        token signed with a rotated key is verified again.
+        """
+        with self._lock:
+            if kids is None:
+                self._entries.clear()
+                return
+            for digest in [digest for digest, entry in self._entries.items()
+                           if entry[2] in kids]:
+                del self._entries[digest]
+
+
+# The keys of the Auth0 tenant, shared by every request of this process
+jwks_cache = JWKSCache(None)
+
+# Payloads of the tokens verified by this process
+token_cache = TokenCache()
+jwks_cache.listeners.append(token_cache.invalidate)
+
+
+def setup_auth(app):
+    """Configures token verification from the app config.
+
+    Reads the AUTH0_DOMAIN, ALGORITHMS and API_AUDIENCE the tokens are
+    checked against, and the JWKS_* and JWT_CACHE_* settings of the
+    caches. Nothing is fetched until the first token is verified.
+    """
+    global AUTH0_DOMAIN, ALGORITHMS, API_AUDIENCE
+    config = app.config
+    AUTH0_DOMAIN = config['AUTH0_DOMAIN']
+    ALGORITHMS = config['ALGORITHMS']
+    API_AUDIENCE = config['API_AUDIENCE']
+
+    jwks_cache.source = read_jwks(config['JWKS_URL'])
+    jwks_cache.ttl = config['JWKS_TTL']
+    jwks_cache.min_refresh_interval = config['JWKS_MIN_REFRESH_INTERVAL']
+    jwks_cache.refresh_interval = config['JWKS_REFRESH_INTERVAL']
+    token_cache.max_entries = config['JWT_CACHE_SIZE']
+    token_cache.ttl = config['JWT_CACHE_TTL']
+
+
 def get_token_auth_header():
     """Attempts to get the bearer token from the request headers.
 
@@ -74,37 +338,35 @@ def verify_decode_jwt(token):
     Raises:
         AuthError: If the JWT is malformed, expired, or not valid for
         the given Auth0 domain/application.
-
-    !!NOTE urlopen has a common certificate error described here:
-    https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
     """
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
     if rsa_key:
         try:
+            # The signature is checked with the cached Key, as jose would
+            # parse the JWK again for every token
+            algorithm, key = rsa_key
+            if unverified_header.get('alg') != algorithm or \
+                    algorithm not in ALGORITHMS:
+                raise jwt.JWTError('The specified alg value is not allowed')
+            signing_input, _, signature = token.rpartition('.')
+            if not key.verify(signing_input.encode(),
+                              base64url_decode(signature.encode())):
+                raise jwt.JWTError('Signature verification failed.')
+
             payload = jwt.decode(
                 token,
-                rsa_key,
+                None,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer='https://' + AUTH0_DOMAIN + '/',
+                options={'verify_signature': False}
             )
             return payload
 
@@ -131,12 +393,36 @@ def verify_decode_jwt(token):
     }, 401)
 
 
-def check_permissions(permission, payload):
+def get_payload(token):
+    """Verifies and decodes a JWT, or reads it from the token cache.
+
+    Args:
+        token: A JSON web token string.
+
+    Returns:
+        A tuple of the decoded JWT payload and its permissions as a set.
+
+    Raises:
+        AuthError: If the token is not in the cache and fails
+                   verify_decode_jwt.
+    """
+    entry = token_cache.get(token)
+    if entry is not None:
+        return entry
+
+    payload = verify_decode_jwt(token)
+    kid = jwt.get_unverified_header(token)['kid']
+    return token_cache.set(token, payload, kid)
+
+
+def check_permissions(permission, payload, permissions=None):
     """Verifies permissions in a JWT payload.
 
     Args:
         permission: The string permission to verify.
         payload: A decoded JWT payload.
+        permissions: The permissions of the payload as a set, if already
+                     computed.
 
     Returns:
         True if the given permission is in the JWT payload.
@@ -151,7 +437,9 @@ def check_permissions(permission, payload):
             'description': 'Permissions not included in JWT'
         }, 403)
 
-    if permission not in payload['permissions']:
+    if permissions is None:
+        permissions = payload['permissions']
+    if permission not in permissions:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found'
@@ -163,7 +451,8 @@ def requires_auth(permission='', test_config=False):
     """Decorator method that checks for the given permission in the request.
 
     Args:
-        permission: The permission to validate.
+        permission: The permission to validate, or a list of permissions
+                    that are all required.
         test_config: Boolean flag used to bypass authorization
                      checks during unit tests.
 
@@ -171,14 +460,18 @@ def requires_auth(permission='', test_config=False):
         AuthError: If the permission is not found,
                    or parsing the Authorization header fails.
     """
+    permissions = [permission] if isinstance(permission, str) \
+        else permission
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             payload = ''
             if not test_config:
                 token = get_token_auth_header()
-                payload = verify_decode_jwt(token)
-                check_permissions(permission, payload)
+                payload, granted = get_payload(token)
+                for required in permissions:
+                    check_permissions(required, payload, granted)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,54 @@
+"""Compares cached and uncached verification of a bearer token."""
+import os
+import time
+
+os.environ.setdefault('ALGORITHMS', 'RS256')
+
+import rsa  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+
+from common import create_benchmark_app, measure  # noqa: E402
+import auth  # noqa: E402
+
+
+def main():
+    # Configures auth from the environment
+    create_benchmark_app(actors=0, movies=0, links=0)
+    public_key, private_key = rsa.newkeys(2048)
+    key = dict(jwk.construct(public_key.save_pkcs1(), 'RS256').to_dict(),
+               kid='benchmark', use='sig')
+    auth.jwks_cache.source = lambda: {'keys': [key]}
+    claims = {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:actors', 'get:movies', 'post:actors']
+    }
+    token = jwt.encode(claims, private_key.save_pkcs1().decode(),
+                       algorithm='RS256', headers={'kid': 'benchmark'})
+
+    def jose_decode():
+        payload = jwt.decode(token, key, algorithms=auth.ALGORITHMS,
+                             audience=auth.API_AUDIENCE,
+                             issuer=claims['iss'])
+        auth.check_permissions('get:movies', payload)
+
+    def uncached():
+        payload = auth.verify_decode_jwt(token)
+        auth.check_permissions('get:movies', payload)
+
+    def cached():
+        payload, permissions = auth.get_payload(token)
+        auth.check_permissions('get:movies', payload, permissions)
+
+    print('%-45s %12s %12s' % ('auth check', 'wall us', 'cpu us'))
+    for label, function in [
+            ('jose decode, JWK parsed per token', jose_decode),
+            ('verify_decode_jwt, cached JWKS', uncached),
+            ('get_payload, cached payload', cached)]:
+        wall, cpu = measure(function, 2000)
+        print('%-45s %12.1f %12.1f' % (label, wall * 1e6, cpu * 1e6))
+
+
+if __name__ == '__main__':
+    main()
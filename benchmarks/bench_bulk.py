@@ -0,0 +1,35 @@
+"""Compares single POSTs against the bulk endpoint for loading Actors."""
+import sys
+import time
+
+from common import create_benchmark_app
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    app = create_benchmark_app(actors=0, movies=0, links=0)
+    client = app.test_client()
+    items = [{'name': 'Actor %d' % i, 'age': 18 + i % 70,
+              'gender': 'MF'[i % 2]} for i in range(count)]
+
+    start = time.perf_counter()
+    for item in items:
+        client.post('/api/actors', json=item)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_size = app.config['MAX_BULK_ITEMS']
+    for offset in range(0, count, batch_size):
+        client.post('/api/actors/bulk',
+                    json=items[offset:offset + batch_size])
+    bulk = time.perf_counter() - start
+
+    print('%-30s %12s %14s' % ('%d actors' % count, 'seconds', 'actors/s'))
+    for label, seconds in [('POST /api/actors', single),
+                           ('POST /api/actors/bulk', bulk)]:
+        print('%-30s %12.3f %14.0f' % (label, seconds, count / seconds))
+    print('speedup: %.1fx' % (single / bulk))
+
+
+if __name__ == '__main__':
+    main()
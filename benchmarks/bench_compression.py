@@ -0,0 +1,37 @@
+"""Compares the CPU cost and size of each compression level."""
+from common import create_benchmark_app, measure
+from compression import brotli, compress
+
+URLS = [
+    '/api/actors?per_page=100',
+    '/api/movies/1',
+    '/api/actors/export?include=movieIds',
+]
+
+
+def main():
+    app = create_benchmark_app()
+    client = app.test_client()
+
+    levels = [('gzip', level) for level in (1, 3, 6, 9)]
+    if brotli is not None:
+        levels += [('br', quality) for quality in (1, 4, 5, 8, 11)]
+
+    for url in URLS:
+        data = client.get(url).data
+        print('%s: %d bytes' % (url, len(data)))
+        print('%-10s %12s %8s %12s %12s' % (
+            'encoding', 'bytes', 'ratio', 'ms', 'MB/s'))
+        for encoding, level in levels:
+            size = len(compress(data, encoding, level))
+            repeat = 10 if len(data) > 100000 else 200
+            seconds = measure(lambda: compress(data, encoding, level),
+                              repeat)[1]
+            print('%-10s %12d %8.2f %12.3f %12.1f' % (
+                '%s %d' % (encoding, level), size, len(data) / size,
+                seconds * 1000, len(data) / seconds / 1e6))
+        print()
+
+
+if __name__ == '__main__':
+    main()
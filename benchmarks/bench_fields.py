@@ -0,0 +1,46 @@
+"""Compares full rows against sparse fieldsets on the read endpoints."""
+from common import create_benchmark_app, measure
+from models import Actor
+from query_utils import project, format_row
+
+CASES = [
+    ('/api/actors?per_page=100', '/api/actors?per_page=100&fields=id,name'),
+    ('/api/actors/1', '/api/actors/1?fields=id,name'),
+    ('/api/movies?per_page=100', '/api/movies?per_page=100&fields=id,title'),
+]
+
+
+def main():
+    app = create_benchmark_app()
+    client = app.test_client()
+
+    print('%-45s %10s %12s %12s' % ('request', 'bytes', 'wall ms', 'cpu ms'))
+    for case in CASES:
+        for url in case:
+            size = len(client.get(url).data)
+            wall, cpu = measure(lambda: client.get(url))
+            print('%-45s %10d %12.3f %12.3f' % (
+                url, size, wall * 1000, cpu * 1000))
+
+    def hydrate():
+        query = Actor.query.order_by(Actor.id).limit(100)
+        return [actor.get_data() for actor in query]
+
+    def select(fields):
+        query = project(Actor.query, Actor, fields).order_by(
+            Actor.id).limit(100)
+        return [format_row(Actor, row, fields) for row in query]
+
+    print()
+    print('%-45s %12s %12s' % ('100 actors', 'wall ms', 'cpu ms'))
+    for label, function in [
+            ('ORM instances + get_data()', hydrate),
+            ('projected columns, all fields', lambda: select(
+                list(Actor.fields))),
+            ('projected columns, id,name', lambda: select(['id', 'name']))]:
+        wall, cpu = measure(function)
+        print('%-45s %12.3f %12.3f' % (label, wall * 1000, cpu * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Measures the co-star graph on a large movie_actors table."""
+import random
+import sys
+import time
+
+from common import create_benchmark_app, measure
+import graph
+
+
+def main():
+    links = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    actors, movies = links // 5, links // 20
+    app = create_benchmark_app(actors=actors, movies=movies, links=links)
+    client = app.test_client()
+    rng = random.Random(1)
+
+    with app.app_context():
+        start = time.perf_counter()
+        graph.use_graph(lambda graph: None)
+        print('%d links: graph built in %.2f s' % (
+            links, time.perf_counter() - start))
+
+    print('%-45s %12s %12s' % ('request', 'wall ms', 'cpu ms'))
+    for label, make_url in [
+            ('/api/actors/<id>/costars', lambda: '/api/actors/%d/costars' % (
+                rng.randint(1, actors))),
+            ('/api/graph/path', lambda: '/api/graph/path?from=%d&to=%d' % (
+                rng.randint(1, actors), rng.randint(1, actors)))]:
+        wall, cpu = measure(lambda: client.get(make_url()), repeat=100)
+        print('%-45s %12.3f %12.3f' % (label, wall * 1000, cpu * 1000))
+
+
+if __name__ == '__main__':
+    main()
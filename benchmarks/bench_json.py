@@ -0,0 +1,43 @@
+"""Compares orjson against the standard library for JSON responses."""
+from common import create_benchmark_app, measure
+from models import Actor, Movie
+from query_utils import project, format_rows
+
+URLS = [
+    '/api/actors?per_page=100',
+    '/api/movies?per_page=100',
+    '/api/actors?ids=' + ','.join(str(i) for i in range(1, 101)),
+]
+
+
+def main():
+    app = create_benchmark_app()
+    client = app.test_client()
+
+    print('%-45s %12s %12s' % ('request', 'stdlib ms', 'orjson ms'))
+    for url in URLS:
+        timings = []
+        for fast in (False, True):
+            app.json.fast = fast
+            timings.append(measure(lambda: client.get(url))[0] * 1000)
+        print('%-45s %12.3f %12.3f' % tuple([url[:45]] + timings))
+
+    print()
+    print('%-45s %12s %12s' % ('dumps of 1000 rows', 'stdlib ms', 'orjson ms'))
+    with app.app_context():
+        for model in (Actor, Movie):
+            fields = list(model.fields)
+            rows = project(model.query, model, fields, 'id').order_by(
+                model.id).limit(1000).all()
+            data = {'success': True, 'rows': format_rows(model, rows, fields)}
+            timings = []
+            for fast in (False, True):
+                app.json.fast = fast
+                timings.append(measure(
+                    lambda: app.json.dumps(data, separators=(',', ':')))[0]
+                    * 1000)
+            print('%-45s %12.3f %12.3f' % tuple([model.__name__] + timings))
+
+
+if __name__ == '__main__':
+    main()
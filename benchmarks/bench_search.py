@@ -0,0 +1,50 @@
+"""Measures /api/search latency on a large actor table.
+
+Usage: python3 benchmarks/bench_search.py [number of actors]
+"""
+import sys
+import random
+
+from common import create_benchmark_app, measure
+
+SYLLABLES = ['ka', 'ri', 'mo', 'ne', 'sa', 'to', 'lu', 'vi', 'del', 'ber',
+             'gon', 'mar', 'ste', 'an', 'el', 'os', 'yu', 'chi', 'ha', 'zo']
+TERMS = ['karimo', 'delber', 'Steanel', 'gonmar', 'yu', 'zz']
+
+
+def fake_name(rng):
+    """Builds a random two word name from the syllables."""
+    return ' '.join(''.join(rng.choice(SYLLABLES) for _ in range(3)).title()
+                    for _ in range(2))
+
+
+def main():
+    actors = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    app = create_benchmark_app(actors=0, movies=0, links=0)
+
+    from models import db, Actor
+    from search import create_search_index
+    rng = random.Random(0)
+    for start in range(0, actors, 50000):
+        db.session.execute(Actor.__table__.insert(), [{
+            'name': fake_name(rng), 'age': 30, 'gender': 'F'
+        } for _ in range(start, min(actors, start + 50000))])
+    db.session.commit()
+    # Rebuild the FTS5 tables, which the Core inserts above bypassed
+    for name in ('actor_words', 'actor_trigrams'):
+        db.session.execute('DROP TABLE IF EXISTS ' + name)
+    db.session.commit()
+    create_search_index(db.engine)
+
+    client = app.test_client()
+    print('%d actors, %s' % (actors, db.engine.dialect.name))
+    print('%-12s %8s %12s' % ('q', 'matches', 'wall ms'))
+    for q in TERMS:
+        url = '/api/search?type=actors&fields=id,name&q=' + q
+        matches = len(client.get(url).get_json()['actors'])
+        wall, _ = measure(lambda: client.get(url), repeat=50)
+        print('%-12s %8d %12.3f' % (q, matches, wall * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Measures the throughput and latency of each gunicorn profile.
+
+Runs `gunicorn wsgi:app` with gunicorn.conf.py for each GUNICORN_PROFILE
+against the benchmark database, with RS256 tokens checked against a
+JWKS served locally. CLIENTS threads send GET requests over keep-alive
+connections for DURATION seconds, in two workloads:
+- cached: the JWKS and the token payload are cached, as usual.
+- upstream wait: every request verifies its token again and refetches
+  the JWKS, which the local server answers after UPSTREAM_DELAY
+  seconds, as if Auth0 or the database were slow.
+"""
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('ALGORITHMS', 'RS256')
+
+import rsa  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+
+from common import ROOT, create_benchmark_app  # noqa: E402
+
+PROFILES = ('sync', 'gthread')
+CLIENTS = 16
+WARMUP = 2
+DURATION = 10
+UPSTREAM_DELAY = 0.02
+PORT = 8731
+
+WORKLOADS = {
+    'cached': {},
+    'upstream wait': {
+        'JWKS_TTL': '0',
+        'JWKS_MIN_REFRESH_INTERVAL': '0',
+        'JWT_CACHE_SIZE': '0'
+    }
+}
+
+
+def serve_jwks(jwks):
+    """Serves a JWKS on a local port, answering after a delay if set.
+
+    Returns:
+        The server, whose delay attribute sets the delay in seconds.
+    """
+    body = json.dumps(jwks).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(server.delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_token():
+    """Returns a JWKS and a token signed with its only key."""
+    public_key, private_key = rsa.newkeys(2048)
+    key = dict(jwk.construct(public_key.save_pkcs1(), 'RS256').to_dict(),
+               kid='benchmark', use='sig')
+    claims = {
+        'iss': 'https://' + os.environ['AUTH0_DOMAIN'] + '/',
+        'aud': os.environ['API_AUDIENCE'],
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:actors', 'get:actor-detail',
+                        'get:movie-detail']
+    }
+    token = jwt.encode(claims, private_key.save_pkcs1().decode(),
+                       algorithm='RS256', headers={'kid': 'benchmark'})
+    return {'keys': [key]}, token
+
+
+def start_server(env):
+    """Starts gunicorn and waits until it answers."""
+    server = subprocess.Popen(
+        ['gunicorn', 'wsgi:app'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT)
+            connection.request('GET', '/api/healthcheck')
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def send_requests(token, seconds):
+    """Sends requests from CLIENTS threads for a number of seconds.
+
+    Returns:
+        The latency of each successful request in seconds, and the
+        number of failed requests.
+    """
+    headers = {'Authorization': 'Bearer ' + token}
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', PORT)
+        i = offset
+        while time.monotonic() < deadline:
+            i += 1
+            url = ['/api/actors?page=%d' % (i % 50 + 1),
+                   '/api/movies/%d' % (i % 2000 + 1),
+                   '/api/actors/%d' % (i % 10000 + 1)][i % 3]
+            start = time.perf_counter()
+            try:
+                connection.request('GET', url, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                # Workers restarted by max_requests close their sockets
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', PORT)
+                errors.append(url)
+                continue
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(url)
+
+    threads = [threading.Thread(target=client, args=(i * 7919,))
+               for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, len(errors)
+
+
+def main():
+    create_benchmark_app()
+    jwks, token = create_token()
+    jwks_server = serve_jwks(jwks)
+
+    print('%-15s %-8s %10s %10s %10s %8s' % (
+        'workload', 'profile', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for workload, settings in WORKLOADS.items():
+        jwks_server.delay = UPSTREAM_DELAY if settings else 0
+        for profile in PROFILES:
+            env = dict(
+                os.environ, **settings, GUNICORN_PROFILE=profile,
+                PORT=str(PORT), APP_SETTINGS='config.ProductionConfig',
+                JWKS_URL='http://127.0.0.1:%d/' % jwks_server.server_port,
+                PYTHONWARNINGS='ignore')
+            server = start_server(env)
+            try:
+                send_requests(token, WARMUP)
+                latencies, errors = send_requests(token, DURATION)
+            finally:
+                server.terminate()
+                server.wait()
+
+            percentiles = statistics.quantiles(latencies, n=100)
+            print('%-15s %-8s %10.0f %10.1f %10.1f %8d' % (
+                workload, profile, len(latencies) / DURATION,
+                percentiles[49] * 1000, percentiles[98] * 1000, errors))
+
+
+if __name__ == '__main__':
+    main()
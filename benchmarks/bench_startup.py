@@ -0,0 +1,70 @@
+"""Measures how long a process takes to get an app ready to serve.
+
+Each run is a fresh interpreter, so imports are not cached. A worker of
+a server without preload_app pays for the imports and create_app, plus
+create_schema where it is enabled. A worker forked from a preloaded
+parent pays for neither.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import ROOT, create_benchmark_app
+
+RUNS = 7
+
+CHILD = '''
+import json, os, sys, time
+sys.path.insert(0, %(root)r)
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app()
+created = time.perf_counter()
+from models import create_schema
+create_schema(app)
+schema_created = time.perf_counter()
+app.test_client().get('/api/healthcheck')
+timings = {
+    'import app': imported - start,
+    'create_app': created - imported,
+    'create_schema': schema_created - created,
+}
+
+# A worker forked from this warm process only handles its first request
+read_end, write_end = os.pipe()
+if os.fork() == 0:
+    forked = time.perf_counter()
+    app.test_client().get('/api/healthcheck')
+    os.write(write_end, str(time.perf_counter() - forked).encode())
+    os._exit(0)
+os.close(write_end)
+timings['forked first request'] = float(os.read(read_end, 64))
+os.wait()
+print(json.dumps(timings))
+'''
+
+
+def main():
+    # The database already has its schema, as a deployed one would
+    create_benchmark_app(actors=0, movies=0, links=0)
+    env = dict(os.environ, APP_SETTINGS='config.ProductionConfig',
+               PYTHONWARNINGS='ignore')
+
+    runs = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD % {'root': ROOT}], env=env,
+            check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+
+    print('%-25s %12s' % ('step', 'median ms'))
+    for step in runs[0]:
+        print('%-25s %12.1f' % (
+            step, statistics.median(run[step] for run in runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compares one commit per request against one commit per model write.
+
+Each endpoint is measured as it is, with the unit of work committing
+once when the request ends, and wrapped in commit_immediately, so that
+every insert(), update() and delete() commits. /benchmark/actors is
+only registered here: it inserts ?count= Actors one by one, like a
+handler that touches several objects.
+"""
+from flask import jsonify, request
+
+from common import create_benchmark_app, measure
+from models import Actor
+from unit_of_work import commit_immediately
+
+REPEAT = 200
+
+
+def benchmark_actors():
+    """Inserts ?count= Actors with one insert() each."""
+    count = int(request.args.get('count', 1))
+    for i in range(count):
+        Actor(name='Benchmark %d' % i, age=40, gender='M').insert()
+    return jsonify({'success': True}), 201
+
+
+def main():
+    app = create_benchmark_app()
+    app.add_url_rule('/benchmark/actors', 'benchmark_actors',
+                     benchmark_actors, methods=['POST'])
+    client = app.test_client()
+    actor = {'name': 'Benchmark', 'age': 40, 'gender': 'F'}
+    ids = iter(range(1, 10001))
+
+    requests = [
+        ('POST /api/actors', 'create_actor',
+         lambda: client.post('/api/actors', json=actor)),
+        ('PATCH /api/actors/<id>', 'update_actor',
+         lambda: client.patch('/api/actors/%d' % next(ids), json={
+             'age': 41, 'addMovies': [1, 2, 3]})),
+        ('POST /benchmark/actors?count=10', 'benchmark_actors',
+         lambda: client.post('/benchmark/actors?count=10')),
+    ]
+
+    print('%-35s %16s %16s' % (
+        'request', 'per write req/s', 'per request req/s'))
+    for name, endpoint, send in requests:
+        view = app.view_functions[endpoint]
+        throughput = []
+        for wrapped in (commit_immediately(view), view):
+            app.view_functions[endpoint] = wrapped
+            assert send().status_code < 300
+            throughput.append(1 / measure(send, REPEAT)[0])
+        app.view_functions[endpoint] = view
+        print('%-35s %16.0f %16.0f' % tuple([name] + throughput))
+
+
+if __name__ == '__main__':
+    main()
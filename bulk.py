@@ -0,0 +1,137 @@
+from flask import request, abort, current_app
+
+from models import db, commit, Change, record_changes
+from query_utils import parse_value
+
+
+def get_bulk_args():
+    """Parses the request body and the 'mode' query string of a bulk insert.
+
+    Returns:
+        A tuple of (items, atomic). atomic is False when 'mode' is
+        'partial', and True when it is 'atomic' or not present.
+
+    Raises:
+        HTTPException: 400 if the body is not a list of at most
+                       MAX_BULK_ITEMS items, or 'mode' is unknown.
+    """
+    items = request.get_json()
+    if not isinstance(items, list):
+        abort(400)
+    if len(items) > current_app.config['MAX_BULK_ITEMS']:
+        abort(400)
+
+    mode = request.args.get('mode', 'atomic')
+    if mode not in ('atomic', 'partial'):
+        abort(400)
+
+    return items, mode == 'atomic'
+
+
+def get_errors(items, schema):
+    """Validates each item against a SchemaValidator.
+
+    Returns:
+        The first validation message for each item, or None if the item
+        is valid.
+    """
+    errors = []
+    for item in items:
+        error = next(schema.iter_errors(item), None)
+        errors.append(None if error is None else error.message)
+
+    return errors
+
+
+def parse_item(model, item):
+    """Converts a valid item to a row of the model's column values.
+
+    Raises:
+        ValueError: If a value passed the schema but cannot be converted
+                    to the type of its column.
+    """
+    columns = model.__table__.c
+    row = {}
+    for key, value in item.items():
+        try:
+            row[model.fields[key]] = parse_value(
+                columns[model.fields[key]], value)
+        except ValueError:
+            raise ValueError('%r is not a valid %r' % (value, key))
+
+    return row
+
+
+def insert_rows(model, rows):
+    """Inserts rows into the table of a model in the current transaction.
+
+    PostgreSQL inserts BULK_BATCH_SIZE rows per multi-row INSERT ...
+    RETURNING. SQLite inserts one row per statement, which costs no
+    round trip, and reads each ID from the cursor.
+
+    Args:
+        model: The Movie or Actor class.
+        rows: Column values keyed by attribute name.
+
+    Returns:
+        The IDs of the rows in the order they were given.
+    """
+    table = model.__table__
+    ids = []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        batch_size = current_app.config['BULK_BATCH_SIZE']
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            result = db.session.execute(
+                table.insert().values(batch).returning(table.c.id))
+            ids.extend(row.id for row in result)
+    else:
+        for row in rows:
+            result = db.session.execute(table.insert(), row)
+            ids.append(result.inserted_primary_key[0])
+
+    return ids
+
+
+def bulk_create(model, schema):
+    """Validates and inserts the items of a bulk request in one transaction.
+
+    In atomic mode nothing is inserted if any item is invalid. In partial
+    mode the valid items are inserted and the invalid ones are reported.
+
+    Args:
+        model: The Movie or Actor class.
+        schema: The SchemaValidator for a single item.
+
+    Returns:
+        A tuple of (results, created). results holds {'id': ...} or
+        {'error': ...} for each item in the order given, or {} for a valid
+        item of a rejected atomic request. created is the number of rows
+        inserted.
+
+    Raises:
+        HTTPException: 400 from get_bulk_args.
+    """
+    items, atomic = get_bulk_args()
+    errors = get_errors(items, schema)
+    rows = []
+    for i, item in enumerate(items):
+        if errors[i] is None:
+            try:
+                rows.append(parse_item(model, item))
+            except ValueError as error:
+                errors[i] = str(error)
+
+    results = [{'error': error} if error else {} for error in errors]
+    if atomic and any(errors):
+        return results, 0
+
+    ids = insert_rows(model, rows)
+    for row, id in zip(rows, ids):
+        row['id'] = id
+    record_changes(db.session, [
+        Change(model.__tablename__, 'insert', row) for row in rows])
+    commit()
+
+    created = iter(ids)
+    return [result or {'id': next(created)} for result in results], len(ids)
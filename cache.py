@@ -0,0 +1,268 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app, make_response
+
+from models import after_commit
+
+# Every ResponseCache created, so commits can invalidate all of them
+_caches = []
+
+# Guards the creation of the cache of an app by concurrent threads
+_setup_lock = threading.Lock()
+
+
+class MemoryStore(object):
+    """An in-process LRU store of strings with per-key expiry.
+
+    It has the subset of the redis-py client methods that ResponseCache
+    uses, so a Redis client can be used as a shared store instead.
+
+    Counters set by incr are not evicted one by one: a cached response
+    could then match a counter that restarted from zero. Once there are
+    max_counters of them, every counter and key is dropped instead, and
+    new counters continue from the highest value dropped, so a version
+    never repeats.
+
+    Attributes:
+        max_entries: The number of keys kept before the least recently
+                     used one is evicted.
+        max_counters: The number of counters kept before all are reset.
+        evictions: The number of keys dropped because they expired, were
+                   least recently used, or were dropped by a reset.
+    """
+
+    def __init__(self, max_entries=1024, max_counters=None):
+        self.max_entries = max_entries
+        self.max_counters = max_counters or max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._counter_floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value of a key, or None if missing or expired."""
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def mget(self, keys):
+        """Returns the values of several keys."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        """Sets a key, expiring after ex seconds if given."""
+        expires = time.monotonic() + ex if ex else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        """Removes keys."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._counters.pop(key, None)
+
+    def incr(self, key):
+        """Increments a counter and returns its new value."""
+        with self._lock:
+            if key not in self._counters and \
+                    len(self._counters) >= self.max_counters:
+                self._counter_floor = max(self._counters.values())
+                self.evictions += len(self._entries)
+                self._counters.clear()
+                self._entries.clear()
+            self._counters[key] = \
+                self._counters.get(key, self._counter_floor) + 1
+            return self._counters[key]
+
+
+class ResponseCache(object):
+    """Caches JSON responses tagged with the rows they were built from.
+
+    Each tag has a version in the store which is incremented when a row
+    it covers changes. A cached response records the versions of its
+    tags and is only served while they are unchanged, so invalidating a
+    tag never has to find the responses that carry it. An epoch counter
+    is incremented with every invalidation, and a response is not cached
+    if the epoch moved while it was built.
+
+    Attributes:
+        store: A MemoryStore, or a client with the same methods.
+        ttl: The number of seconds a response is kept.
+        hits: The number of responses served from the cache.
+        misses: The number of responses that had to be built.
+        stale: The number of cached responses dropped by invalidation.
+    """
+
+    def __init__(self, store, ttl=60):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def get_versions(self, tags):
+        """Returns the current version of each tag."""
+        values = self.store.mget(['tag:' + tag for tag in tags])
+        return {tag: int(value or 0) for tag, value in zip(tags, values)}
+
+    def get(self, key):
+        """Returns a cached body, or None if missing or stale."""
+        value = self.store.get('response:' + key)
+        if value is not None:
+            entry = json.loads(value)
+            if self.get_versions(list(entry['tags'])) == entry['tags']:
+                with self._lock:
+                    self.hits += 1
+                return entry['body']
+            self.store.delete('response:' + key)
+            with self._lock:
+                self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, body, versions):
+        """Caches a body with the tag versions read before it was built."""
+        self.store.set('response:' + key, json.dumps(
+            {'body': body, 'tags': versions}), ex=self.ttl)
+
+    def get_epoch(self):
+        """Returns the number of invalidations so far."""
+        return int(self.store.get('epoch') or 0)
+
+    def invalidate(self, tags):
+        """Makes every response with one of the tags stale."""
+        for tag in tags:
+            self.store.incr('tag:' + tag)
+        self.store.incr('epoch')
+
+    def get_metrics(self):
+        """Returns the counters of the cache as a dictionary."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.stale + getattr(self.store, 'evictions', 0)
+        }
+
+
+def get_cache():
+    """Returns the ResponseCache of the current app, creating it once.
+
+    RESPONSE_CACHE_STORE sets the store, which defaults to a MemoryStore
+    of RESPONSE_CACHE_SIZE responses.
+    """
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        with _setup_lock:
+            cache = current_app.extensions.get('response_cache')
+            if cache is None:
+                store = current_app.config.get('RESPONSE_CACHE_STORE') or \
+                    MemoryStore(current_app.config['RESPONSE_CACHE_SIZE'])
+                cache = ResponseCache(
+                    store, current_app.config['RESPONSE_CACHE_TTL'])
+                current_app.extensions['response_cache'] = cache
+
+    return cache
+
+
+def get_cache_key(payload):
+    """Returns a key for the route, query string and permissions."""
+    permissions = sorted(payload.get('permissions', [])) if payload else []
+    key = json.dumps([request.path, sorted(request.args.items(multi=True)),
+                      permissions])
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def cached(*tags, related=None):
+    """Decorator to cache successful responses of a GET endpoint.
+
+    It must be applied below requires_auth, so that every request is
+    still authorized.
+
+    Args:
+        *tags: Tags of the response. '{name}' is replaced with the
+               view argument called name, e.g. 'actor:{actor_id}'.
+        related: The key of a list of related rows in the response JSON,
+                 whose IDs are tagged as '<key without s>:<id>'.
+    """
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            if not current_app.config['RESPONSE_CACHE_ENABLED']:
+                return f(payload, *args, **kwargs)
+
+            cache = get_cache()
+            key = get_cache_key(payload)
+            body = cache.get(key)
+            if body is not None:
+                response = current_app.response_class(
+                    body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            epoch = cache.get_epoch()
+            versions = cache.get_versions(
+                [tag.format(**kwargs) for tag in tags])
+            response = make_response(f(payload, *args, **kwargs))
+            response.headers['X-Cache'] = 'MISS'
+            if response.status_code != 200 or not response.is_json:
+                return response
+
+            if related:
+                related_tags = [
+                    related[:-1] + ':' + str(row['id'])
+                    for item in response.get_json().values()
+                    if isinstance(item, dict)
+                    for row in item.get(related, [])]
+                versions.update(cache.get_versions(related_tags))
+            # A replica may not have the latest writes yet
+            router = current_app.extensions.get('db_router')
+            if cache.get_epoch() == epoch and not (
+                    router is not None and router.is_stale_read()):
+                cache.set(key, response.get_data(as_text=True), versions)
+            return response
+
+        return wrapper
+    return cached_decorator
+
+
+def get_tags(change):
+    """Returns the tags of the responses a Change makes stale."""
+    if change.table == 'movie_actors':
+        return ['actor:%d' % change.row['actor_id'],
+                'movie:%d' % change.row['movie_id'],
+                'movie_actors']
+
+    return [change.table, '%s:%d' % (change.table, change.row['id'])]
+
+
+@after_commit
+def invalidate_responses(changes):
+    """Invalidates the cached responses affected by committed Changes."""
+    tags = {tag for change in changes for tag in get_tags(change)}
+    for cache in _caches:
+        cache.invalidate(tags)
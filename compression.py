@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import zlib
+from flask import request, current_app
+
+from cache import MemoryStore
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings in order of preference when the client accepts several
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+# Guards the creation of the store of an app by concurrent threads
+_setup_lock = threading.Lock()
+
+
+def get_encoding():
+    """Returns the encoding negotiated from Accept-Encoding, or None."""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+class Compressor(object):
+    """Incrementally compresses a body with gzip or brotli.
+
+    Attributes:
+        encoding: 'gzip' or 'br'.
+    """
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            # wbits of 31 writes a gzip header with no timestamp, so the
+            # same body always compresses to the same bytes
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        """Compresses a chunk, flushing it to the output if flush is set.
+
+        Flushing lets a streaming client decode each chunk as it arrives,
+        at the cost of a slightly worse ratio.
+        """
+        if self.encoding == 'br':
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) \
+            if flush else output
+
+    def finish(self):
+        """Returns the end of the compressed body."""
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def get_level(encoding):
+    """Returns the configured compression level of an encoding."""
+    if encoding == 'br':
+        return current_app.config['COMPRESSION_BROTLI_QUALITY']
+    return current_app.config['COMPRESSION_GZIP_LEVEL']
+
+
+def compress(data, encoding, level):
+    """Compresses a whole body."""
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding, level):
+    """Compresses the chunks of a streamed body as they are produced."""
+    compressor = Compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        output = compressor.compress(chunk, flush=True)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+def get_store():
+    """Returns the store of compressed bodies of the current app."""
+    store = current_app.extensions.get('compressed_bodies')
+    if store is None:
+        with _setup_lock:
+            store = current_app.extensions.get('compressed_bodies')
+            if store is None:
+                store = MemoryStore(
+                    current_app.config['COMPRESSION_CACHE_SIZE'])
+                current_app.extensions['compressed_bodies'] = store
+
+    return store
+
+
+def compress_response(response):
+    """Compresses a JSON or NDJSON response for the negotiated encoding.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE bytes are sent as they are.
+    Streamed bodies are compressed chunk by chunk. Bodies from the
+    response cache, marked by its X-Cache header, are compressed once
+    and then served from a store keyed by the digest of the body. The
+    ETag gets the encoding as a suffix, since the bytes differ.
+    """
+    if not current_app.config['COMPRESSION_ENABLED'] or \
+            response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+            response.status_code != 200 or \
+            'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding()
+    if encoding is None:
+        return response
+    level = get_level(encoding)
+
+    if response.is_streamed:
+        response.response = compress_stream(
+            response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+            return response
+
+        if 'X-Cache' in response.headers:
+            store = get_store()
+            key = '%s:%d:%s' % (
+                encoding, level, hashlib.sha1(data).hexdigest())
+            compressed = store.get(key)
+            if compressed is None:
+                compressed = compress(data, encoding, level)
+                store.set(key, compressed)
+        else:
+            compressed = compress(data, encoding, level)
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + '-' + encoding, weak)
+    return response
+
+
+def setup_compression(app):
+    """Compresses the responses of an app after each request."""
+    app.after_request(compress_response)
@@ -1,4 +1,9 @@
-from auth import AUTH0_DOMAIN, API_AUDIENCE, CLIENT_ID
+import os
+
+# The environment is read once, when create_app loads the config
+AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
+API_AUDIENCE = os.environ['API_AUDIENCE']
+CLIENT_ID = os.environ['CLIENT_ID']
 
 
 def get_auth0_login_url(redirect_uri):
@@ -10,14 +15,67 @@ def get_auth0_login_url(redirect_uri):
 
 class Config(object):
     """Default app config."""
+    DATABASE_URL = os.environ['DATABASE_URL']
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get(
+        'DATABASE_REPLICA_URLS', '').split(',') if url]
+    AUTH0_DOMAIN = AUTH0_DOMAIN
+    ALGORITHMS = os.environ['ALGORITHMS']
+    API_AUDIENCE = API_AUDIENCE
+    CLIENT_ID = CLIENT_ID
+    JWKS_URL = os.environ.get(
+        'JWKS_URL', 'https://' + AUTH0_DOMAIN + '/.well-known/jwks.json')
+    JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+    JWKS_MIN_REFRESH_INTERVAL = int(
+        os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+    JWKS_REFRESH_INTERVAL = int(os.environ.get('JWKS_REFRESH_INTERVAL', 0))
+    JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', 4096))
+    JWT_CACHE_TTL = int(os.environ.get('JWT_CACHE_TTL', 0))
     DEBUG = True
     TESTING = False
     CSRF_ENABLED = False
+    ITEMS_PER_PAGE = 10
+    MAX_ITEMS_PER_PAGE = 100
+    COUNT_CACHE_TTL = 30
+    EXPORT_BATCH_SIZE = 1000
+    ID_CHUNK_SIZE = 500
+    MAX_IDS_PER_REQUEST = 100
+    MAX_BULK_ITEMS = 10000
+    BULK_BATCH_SIZE = 1000
+    GRAPH_MAX_AGE = 300
+    GRAPH_OVERLAY_LIMIT = 10000
+    STATS_AGE_BUCKET = 10
+    STATS_MAX_AGE = 300
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_SIZE = 1024
+    RESPONSE_CACHE_TTL = 60
+    RESPONSE_CACHE_STORE = None
+    FAST_JSON_ENABLED = True
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_GZIP_LEVEL = 6
+    COMPRESSION_BROTLI_QUALITY = 5
+    COMPRESSION_CACHE_SIZE = 256
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    DB_POOL_FAIL_FAST_WAIT = None
+    DB_CREATE_SCHEMA = True
+    DB_REPLICA_STICKY_SECONDS = 5
+    DB_REPLICA_MAX_LAG = 2
+    DB_REPLICA_LAG_CHECK_INTERVAL = 1
+    DB_REPLICA_STICKY_STORE = None
 
 
 class ProductionConfig(Config):
     """App config for Production environment."""
     DEBUG = False
+    DB_POOL_SIZE = 10
+    DB_MAX_OVERFLOW = 5
+    DB_POOL_RECYCLE = 300
+    DB_POOL_FAIL_FAST_WAIT = 2
+    DB_CREATE_SCHEMA = False
     AUTH0_LOGIN = get_auth0_login_url(
         'https://tomivanpete-casting-agency.herokuapp.com/api/healthcheck')
 
@@ -0,0 +1,150 @@
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics(object):
+    """Counters of the connections checked out of a pool.
+
+    Attributes:
+        checkouts: The number of connections checked out.
+        wait: The total seconds spent checking connections out, including
+              waiting for a free one and opening new ones.
+        max_wait: The longest checkout in seconds.
+        max_in_use: The highest number of connections checked out at
+                    once.
+        overflows: The number of checkouts beyond the pool size.
+        timeouts: The number of checkouts that gave up after the timeout.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        self.max_in_use = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def get_data(self):
+        """Returns a dictionary representation of the counters."""
+        return {
+            'checkouts': self.checkouts,
+            'averageWaitMs': round(
+                self.wait / self.checkouts * 1000, 3) if self.checkouts
+            else 0,
+            'maxWaitMs': round(self.max_wait * 1000, 3),
+            'maxInUse': self.max_in_use,
+            'overflows': self.overflows,
+            'timeouts': self.timeouts
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that times its checkouts in PoolMetrics.
+
+    Attributes:
+        metrics: The PoolMetrics of the pool, kept when engine.dispose()
+                 recreates it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def connect(self):
+        return self._checkout(super().connect)
+
+    def unique_connection(self):
+        # What Engine.connect uses on SQLAlchemy 1.3
+        return self._checkout(super().unique_connection)
+
+    def _checkout(self, connect):
+        """Calls connect, timing it and counting timeouts."""
+        start = time.perf_counter()
+        try:
+            connection = connect()
+        except exc.TimeoutError:
+            with self.metrics.lock:
+                self.metrics.timeouts += 1
+            raise
+
+        wait = time.perf_counter() - start
+        with self.metrics.lock:
+            self.metrics.wait += wait
+            self.metrics.max_wait = max(self.metrics.max_wait, wait)
+        return connection
+
+
+def instrument_pool(engine):
+    """Counts the checkouts of an engine's InstrumentedQueuePool.
+
+    The listener is added to the engine, so it carries over to the pools
+    that engine.dispose() creates.
+    """
+    @event.listens_for(engine, 'checkout')
+    def count_checkout(dbapi_connection, connection_record,
+                       connection_proxy):
+        pool = engine.pool
+        metrics = pool.metrics
+        in_use = pool.checkedout()
+        with metrics.lock:
+            metrics.checkouts += 1
+            metrics.max_in_use = max(metrics.max_in_use, in_use)
+            if in_use > pool.size():
+                metrics.overflows += 1
+
+
+def get_engine_options(config, uri):
+    """Returns the engine options for the DB_POOL_* settings.
+
+    SQLite keeps the pool SQLAlchemy picks for it, since a file or memory
+    database gains nothing from a queue of connections.
+
+    Args:
+        config: The app config.
+        uri: The database URI.
+
+    Returns:
+        A dictionary for SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    if uri.startswith('sqlite'):
+        return {}
+
+    timeout = config['DB_POOL_TIMEOUT']
+    if config['DB_POOL_FAIL_FAST_WAIT'] is not None:
+        timeout = config['DB_POOL_FAIL_FAST_WAIT']
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': timeout,
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING']
+    }
+
+
+def get_pool_metrics(engine):
+    """Returns the counters of an engine's pool, or None if it has none.
+
+    Besides the PoolMetrics counters, 'inUse', 'size' and 'overflowOpen'
+    describe the pool right now. 'overflowOpen' is the number of
+    connections open beyond the pool size: QueuePool.overflow() counts
+    from -size, so it is negative while the pool is not yet full.
+    """
+    metrics = getattr(engine.pool, 'metrics', None)
+    if metrics is None:
+        return None
+
+    data = metrics.get_data()
+    data['inUse'] = engine.pool.checkedout()
+    data['size'] = engine.pool.size()
+    data['overflowOpen'] = max(engine.pool.overflow(), 0)
+    return data
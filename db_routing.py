@@ -0,0 +1,214 @@
+import hashlib
+import random
+import threading
+import time
+from flask import current_app, g, has_app_context, has_request_context, \
+    request
+from sqlalchemy import exc, text
+
+from models import db, after_commit
+from db_pool import instrument_pool
+from cache import MemoryStore
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds the standby is behind the primary, or 0 when it has replayed
+# everything it received. NULL on a server that is not a standby.
+POSTGRES_LAG_SQL = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) '
+    'END')
+
+
+class ReplicaRouter(object):
+    """Picks the database that serves the queries of a request.
+
+    Reads of GET and HEAD requests go to a replica, unless the client
+    committed a write in the last sticky_seconds, or no replica is within
+    max_lag seconds of the primary. Everything else goes to the primary.
+
+    Attributes:
+        engines: The engine of each replica keyed by its bind key.
+        store: A MemoryStore, or a Redis client, holding the clients that
+               wrote recently.
+        sticky_seconds: How long a client reads from the primary after a
+                        write.
+        max_lag: The replication lag in seconds above which a replica is
+                 skipped.
+        lag_check_interval: How long a measured lag is trusted, in seconds.
+        lags: The last lag of each replica as (seconds, time measured).
+        replica_reads: The number of requests routed to a replica.
+        primary_reads: The number of read requests kept on the primary.
+        lag_fallbacks: How many of those were kept because of lag.
+    """
+
+    def __init__(self, engines, store, sticky_seconds=5, max_lag=2,
+                 lag_check_interval=1):
+        self.engines = engines
+        self.store = store
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.lags = {}
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.lag_fallbacks = 0
+        self._lock = threading.Lock()
+
+    def get_lag(self, bind):
+        """Returns the lag of a replica, measured at most once an interval.
+
+        A replica that cannot be reached counts as infinitely behind.
+        """
+        lag, measured = self.lags.get(bind, (None, 0))
+        now = time.monotonic()
+        if lag is None or now - measured >= self.lag_check_interval:
+            try:
+                with self.engines[bind].connect() as connection:
+                    lag = read_lag(connection)
+            except exc.SQLAlchemyError:
+                lag = float('inf')
+            self.lags[bind] = (lag, now)
+
+        return lag
+
+    def choose_bind(self):
+        """Returns the bind key of a replica for the request, or None."""
+        if request.method not in READ_METHODS or \
+                self.store.get('client:' + get_client_key()) is not None:
+            with self._lock:
+                self.primary_reads += 1
+            return None
+
+        binds = [bind for bind in self.engines
+                 if self.get_lag(bind) <= self.max_lag]
+        if not binds:
+            with self._lock:
+                self.primary_reads += 1
+                self.lag_fallbacks += 1
+            return None
+
+        with self._lock:
+            self.replica_reads += 1
+        return random.choice(binds)
+
+    def get_read_engine(self):
+        """Returns the replica engine serving this request, or None.
+
+        The choice is made on the first query of a request and kept for
+        the rest of it, so a request never mixes data from two databases.
+        """
+        if not self.engines or not has_request_context():
+            return None
+
+        if 'db_bind' not in g:
+            g.db_bind = self.choose_bind()
+        return self.engines.get(g.db_bind)
+
+    def is_stale_read(self):
+        """Whether the request read from a replica shortly after a write.
+
+        The replica may not have the write yet, so the response must not
+        be cached in place of the one the write invalidated.
+        """
+        return g.get('db_bind') is not None and \
+            self.store.get('write') is not None
+
+    def record_write(self, client_key=None):
+        """Keeps a client, and fresh responses, on the primary for a while.
+
+        Args:
+            client_key: The key of the client that wrote, if any.
+        """
+        if client_key is not None:
+            self.store.set('client:' + client_key, '1',
+                           ex=self.sticky_seconds)
+        self.store.set('write', '1', ex=self.sticky_seconds)
+
+    def get_metrics(self):
+        """Returns the counters of the router as a dictionary."""
+        return {
+            'replicaReads': self.replica_reads,
+            'primaryReads': self.primary_reads,
+            'lagFallbacks': self.lag_fallbacks,
+            'lagSeconds': {
+                bind: None if lag == float('inf') else round(lag, 3)
+                for bind, (lag, measured) in self.lags.items()}
+        }
+
+
+def read_lag(connection):
+    """Returns how many seconds a replica is behind its primary.
+
+    Only Postgres streaming replicas report a lag. Any other database,
+    e.g. a second SQLite file or Postgres database used for local
+    testing, counts as up to date.
+    """
+    if connection.dialect.name != 'postgresql':
+        return 0.0
+    return float(connection.execute(POSTGRES_LAG_SQL).scalar() or 0)
+
+
+def get_client_key():
+    """Returns a key for the client of the request.
+
+    Clients are told apart by their Authorization header, or by their
+    address when they send none.
+    """
+    authorization = request.headers.get('Authorization')
+    if authorization is None:
+        return request.remote_addr or ''
+    return hashlib.sha1(authorization.encode()).hexdigest()
+
+
+@after_commit
+def stick_to_primary(changes):
+    """Sends the reads of the writing client to the primary for a while."""
+    if not has_app_context():
+        return
+    router = current_app.extensions.get('db_router')
+    if router is not None and router.engines:
+        router.record_write(
+            get_client_key() if has_request_context() else None)
+
+
+def forget_read_bind():
+    """Drops the bind chosen by an earlier request in the same context."""
+    g.pop('db_bind', None)
+
+
+def setup_replicas(app, urls=None):
+    """Adds read replicas to an app as binds called replica0, replica1...
+
+    The router is configured by the DB_REPLICA_* settings of the app
+    config. Calling it again replaces the replicas, and an empty list
+    sends everything to the primary.
+
+    Args:
+        app: The Flask app.
+        urls: The database URIs of the replicas, by default the
+              DATABASE_REPLICA_URLS of the app config.
+    """
+    if urls is None:
+        urls = app.config['DATABASE_REPLICA_URLS']
+    binds = {'replica%d' % i: url for i, url in enumerate(urls)}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    router = app.extensions.get('db_router')
+    if router is None:
+        app.before_request(forget_read_bind)
+
+    engines = {}
+    for bind in binds:
+        engines[bind] = db.get_engine(app, bind)
+        if 'poolclass' in app.config['SQLALCHEMY_ENGINE_OPTIONS'] and (
+                router is None or
+                engines[bind] not in router.engines.values()):
+            instrument_pool(engines[bind])
+
+    app.extensions['db_router'] = ReplicaRouter(
+        engines,
+        app.config['DB_REPLICA_STICKY_STORE'] or MemoryStore(),
+        app.config['DB_REPLICA_STICKY_SECONDS'],
+        app.config['DB_REPLICA_MAX_LAG'],
+        app.config['DB_REPLICA_LAG_CHECK_INTERVAL'])
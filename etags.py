@@ -0,0 +1,130 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import request, current_app, make_response
+from sqlalchemy import func, literal, select, union_all
+
+from models import db, after_setup, after_flush, table_versions
+from compression import ENCODINGS
+
+# Tables whose writes are counted in table_version
+VERSIONED_TABLES = ('actor', 'movie', 'movie_actors')
+
+# The time of the last write when nothing records one
+EPOCH = datetime(1970, 1, 1)
+
+
+@after_setup
+def create_table_versions(engine):
+    """Inserts the table_version rows missing for VERSIONED_TABLES."""
+    with engine.begin() as connection:
+        existing = {row.name for row in connection.execute(
+            select([table_versions.c.name]))}
+        missing = [{'name': name, 'version': 0,
+                    'updated_at': datetime.utcnow()}
+                   for name in VERSIONED_TABLES if name not in existing]
+        if missing:
+            connection.execute(table_versions.insert(), missing)
+
+
+@after_flush
+def bump_table_versions(session, changes):
+    """Increments the version of each table written in a flush."""
+    names = {change.table for change in changes}
+    if not names:
+        return
+
+    session.execute(table_versions.update().where(
+        table_versions.c.name.in_(names)).values(
+        version=table_versions.c.version + 1,
+        updated_at=datetime.utcnow()))
+
+
+def get_versions(tables, row=None):
+    """Reads the version counters a response is built from in one query.
+
+    Args:
+        tables: Names of the tables in table_version.
+        row: A (model, id) of a Movie or Actor, whose own version is read.
+
+    Returns:
+        A tuple of (versions, time of the last write), or None if the
+        row does not exist. The time is EPOCH if no write is recorded.
+    """
+    queries = [select([
+        table_versions.c.name, table_versions.c.version,
+        func.coalesce(table_versions.c.updated_at, EPOCH)
+    ]).where(table_versions.c.name.in_(tables))]
+    if row is not None:
+        model, item_id = row
+        key = '%s:%d' % (model.__tablename__, item_id)
+        queries.append(select([
+            literal(key).label('name'), model.version,
+            func.coalesce(model.updated_at, EPOCH)
+        ]).where(model.id == item_id))
+
+    results = sorted(db.session.execute(union_all(*queries)))
+    if row is not None and key not in [result[0] for result in results]:
+        return None
+
+    return ([(name, version) for name, version, _ in results],
+            max((updated_at for _, _, updated_at in results), default=EPOCH))
+
+
+def conditional(*tables, row=None):
+    """Decorator to answer conditional GETs from version counters.
+
+    The ETag and Last-Modified of a response are derived from the
+    versions of the tables and row it is built from, so a request whose
+    If-None-Match or If-Modified-Since still matches is answered with 304
+    Not Modified without running the endpoint. It must be applied below
+    requires_auth, so that every request is still authorized.
+
+    If-None-Match takes precedence over If-Modified-Since. Last-Modified
+    only has whole seconds, so it is neither sent nor used for a 304
+    until the second of the last write is over: another write in that
+    second would not change it.
+
+    Args:
+        *tables: Names of the tables the response is built from.
+        row: For a detail endpoint, the model and the name of the view
+             argument holding the ID of the row.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            row_id = (row[0], kwargs[row[1]]) if row else None
+            current = get_versions(tables, row_id)
+            if current is None:
+                return f(payload, *args, **kwargs)
+
+            versions, updated_at = current
+            etag = hashlib.sha1(repr(versions).encode()).hexdigest()[:20]
+            last_modified = updated_at.replace(
+                microsecond=0, tzinfo=timezone.utc)
+            settled = datetime.utcnow() - updated_at >= timedelta(seconds=1)
+
+            if request.if_none_match:
+                # A compressed response has the encoding as a suffix
+                matched = [tag for tag in [etag] + [
+                    etag + '-' + encoding for encoding in ENCODINGS]
+                    if request.if_none_match.contains(tag)]
+                not_modified = bool(matched)
+            else:
+                since = request.if_modified_since
+                not_modified = settled and since is not None and \
+                    last_modified <= since
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+                etag = matched[0] if request.if_none_match else etag
+            else:
+                response = make_response(f(payload, *args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if settled:
+                    response.last_modified = last_modified
+            return response
+
+        return wrapper
+    return conditional_decorator
@@ -0,0 +1,75 @@
+from flask import Response, current_app, stream_with_context
+
+from models import db
+from query_utils import get_fields_args, filter_query, project, format_row
+
+
+def export_rows(model, relation, ids_key=None):
+    """Streams every row of a table as newline delimited JSON.
+
+    Rows are read with a server-side cursor in batches of
+    EXPORT_BATCH_SIZE so memory use does not grow with the table. The
+    model's filters in the query strings are applied.
+
+    Args:
+        model: The Movie or Actor class.
+        relation: The name of the model's many-to-many relationship.
+        ids_key: If given, the IDs of the related rows are added to each
+                 row under this key, fetched with one query per batch.
+
+    Returns:
+        A streaming application/x-ndjson response.
+
+    Raises:
+        HTTPException: 400 if an unknown field or invalid filter is requested.
+    """
+    fields = get_fields_args(model)
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    query, _ = filter_query(model.query, model)
+    query = project(query, model, fields, 'id').order_by(
+        model.id).execution_options(stream_results=True).yield_per(
+        batch_size)
+
+    def generate():
+        batch = []
+        for row in query:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield format_batch(model, relation, fields, batch, ids_key)
+                batch = []
+        if batch:
+            yield format_batch(model, relation, fields, batch, ids_key)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+def get_related_ids(model, relation, ids):
+    """Returns a dictionary of related row IDs for each of the given IDs."""
+    prop = getattr(model, relation).property
+    owner_column = prop.synchronize_pairs[0][1]
+    related_column = prop.secondary_synchronize_pairs[0][1]
+
+    related_ids = {id: [] for id in ids}
+    links = db.session.query(owner_column, related_column).filter(
+        owner_column.in_(ids)).order_by(related_column)
+    for owner_id, related_id in links:
+        related_ids[owner_id].append(related_id)
+
+    return related_ids
+
+
+def format_batch(model, relation, fields, rows, ids_key):
+    """Returns the NDJSON lines for a batch of rows from project."""
+    if ids_key:
+        related_ids = get_related_ids(
+            model, relation, [row.id for row in rows])
+
+    lines = []
+    for row in rows:
+        data = format_row(model, row, fields)
+        if ids_key:
+            data[ids_key] = related_ids[row.id]
+        lines.append(current_app.json.dumps(data, separators=(',', ':')))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,297 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, after_commit, movie_actors
+
+# The graph for this process, built on first use
+_graph = None
+_built_at = None
+_lock = threading.Lock()
+
+
+class Adjacency(object):
+    """Neighbours of one side of the bipartite graph in CSR form.
+
+    Attributes:
+        keys: Sorted IDs of the nodes with at least one neighbour.
+        offsets: Start of the neighbours of each key in targets, followed
+                 by the end of the last one.
+        targets: IDs of the neighbours of all keys, sorted per key.
+    """
+
+    def __init__(self, pairs):
+        """Builds the arrays from (key, target) pairs sorted by both."""
+        self.keys = array('q')
+        self.offsets = array('q')
+        self.targets = array('q')
+        for key, target in pairs:
+            if not self.keys or self.keys[-1] != key:
+                self.keys.append(key)
+                self.offsets.append(len(self.targets))
+            self.targets.append(target)
+        self.offsets.append(len(self.targets))
+
+    def get(self, key):
+        """Returns the sorted neighbours of a node."""
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return ()
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def contains(self, key, target):
+        """Returns whether target is a neighbour of key."""
+        targets = self.get(key)
+        index = bisect_left(targets, target)
+        return index < len(targets) and targets[index] == target
+
+
+class Side(object):
+    """One side of the graph with the links changed since it was built.
+
+    Attributes:
+        base: The Adjacency built from the DB or by compact.
+        added: Sets of neighbours linked since, keyed by node.
+        removed: Sets of neighbours unlinked since, keyed by node.
+        changes: The number of neighbours in added and removed.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.added = {}
+        self.removed = {}
+        self.changes = 0
+
+    def neighbours(self, key):
+        """Returns the current neighbours of a node."""
+        targets = self.base.get(key)
+        added = self.added.get(key)
+        removed = self.removed.get(key)
+        if not added and not removed:
+            return targets
+
+        targets = [target for target in targets
+                   if not removed or target not in removed]
+        return targets + sorted(added) if added else targets
+
+    def link(self, key, target):
+        """Adds a neighbour. Linking an existing neighbour does nothing."""
+        removed = self.removed.get(key)
+        if removed and target in removed:
+            removed.discard(target)
+            self.changes -= 1
+        elif not self.base.contains(key, target):
+            added = self.added.setdefault(key, set())
+            if target not in added:
+                added.add(target)
+                self.changes += 1
+
+    def unlink(self, key, target):
+        """Removes a neighbour. Unlinking a non-neighbour does nothing."""
+        added = self.added.get(key)
+        if added and target in added:
+            added.discard(target)
+            self.changes -= 1
+        elif self.base.contains(key, target):
+            removed = self.removed.setdefault(key, set())
+            if target not in removed:
+                removed.add(target)
+                self.changes += 1
+
+    def compact(self):
+        """Merges the changed links into a new base Adjacency."""
+        keys = sorted(set(self.base.keys) | set(self.added))
+        self.base = Adjacency(
+            (key, target) for key in keys
+            for target in sorted(self.neighbours(key)))
+        self.added = {}
+        self.removed = {}
+        self.changes = 0
+
+
+class CastingGraph(object):
+    """The bipartite graph of Actors and Movies linked by movie_actors.
+
+    Attributes:
+        actors: Movie IDs keyed by Actor ID.
+        movies: Actor IDs keyed by Movie ID.
+        overlay_limit: The number of changed links a side may hold
+                       before its arrays are rebuilt.
+    """
+
+    def __init__(self, actors, movies, overlay_limit=10000):
+        self.actors = Side(actors)
+        self.movies = Side(movies)
+        self.overlay_limit = overlay_limit
+
+    def link(self, actor_id, movie_id):
+        """Adds a link between an Actor and a Movie."""
+        self.actors.link(actor_id, movie_id)
+        self.movies.link(movie_id, actor_id)
+
+    def unlink(self, actor_id, movie_id):
+        """Removes the link between an Actor and a Movie."""
+        self.actors.unlink(actor_id, movie_id)
+        self.movies.unlink(movie_id, actor_id)
+
+    def compact(self):
+        """Rebuilds the arrays of a side once it has too many changes."""
+        for side in (self.actors, self.movies):
+            if side.changes > self.overlay_limit:
+                side.compact()
+
+    def get_costars(self, actor_id):
+        """Counts the Movies an Actor shares with each co-star.
+
+        Returns:
+            A list of (co-star ID, shared Movies) with the most shared
+            Movies first, then by ID.
+        """
+        shared = {}
+        for movie_id in self.actors.neighbours(actor_id):
+            for costar_id in self.movies.neighbours(movie_id):
+                if costar_id != actor_id:
+                    shared[costar_id] = shared.get(costar_id, 0) + 1
+
+        return sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+
+    def find_path(self, source_id, target_id):
+        """Finds a shortest chain of co-stars between two Actors.
+
+        A breadth-first search runs from both Actors, always expanding
+        the smaller frontier by a whole level, until the searches meet.
+
+        Returns:
+            A tuple of (Actor IDs, Movie IDs) where the Actors at i and
+            i + 1 both appear in the Movie at i, or None if the Actors are
+            not connected.
+        """
+        if source_id == target_id:
+            return [source_id], []
+
+        # Parents of the Actors reached from each end as (actor, movie)
+        parents = ({source_id: None}, {target_id: None})
+        depths = ({source_id: 0}, {target_id: 0})
+        frontiers = ([source_id], [target_id])
+        seen_movies = (set(), set())
+
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            other = 1 - side
+            frontier = []
+            meeting = None
+
+            for actor_id in frontiers[side]:
+                for movie_id in self.actors.neighbours(actor_id):
+                    if movie_id in seen_movies[side]:
+                        continue
+                    seen_movies[side].add(movie_id)
+
+                    for costar_id in self.movies.neighbours(movie_id):
+                        if costar_id in parents[side]:
+                            continue
+                        parents[side][costar_id] = (actor_id, movie_id)
+                        depths[side][costar_id] = depths[side][actor_id] + 1
+                        frontier.append(costar_id)
+
+                        # Finish the level to keep the shortest meeting
+                        if costar_id in parents[other] and (
+                                meeting is None or depths[other][costar_id]
+                                < depths[other][meeting]):
+                            meeting = costar_id
+
+            if meeting is not None:
+                return self._join(parents, meeting)
+            frontiers = (frontier, frontiers[1]) if side == 0 else (
+                frontiers[0], frontier)
+
+        return None
+
+    @staticmethod
+    def _join(parents, meeting):
+        """Returns the path through the Actor where the searches met."""
+        actor_ids = [meeting]
+        movie_ids = []
+        for side in (0, 1):
+            parent = parents[side][meeting]
+            while parent is not None:
+                actor_id, movie_id = parent
+                if side == 0:
+                    actor_ids.insert(0, actor_id)
+                    movie_ids.insert(0, movie_id)
+                else:
+                    actor_ids.append(actor_id)
+                    movie_ids.append(movie_id)
+                parent = parents[side][actor_id]
+
+        return actor_ids, movie_ids
+
+
+def build_graph(overlay_limit):
+    """Reads movie_actors into a new CastingGraph."""
+    connection = db.session.connection().execution_options(
+        stream_results=True)
+
+    def read_pairs(key, target):
+        return connection.execute(
+            select([key, target]).order_by(key, target))
+
+    actors = Adjacency(read_pairs(
+        movie_actors.c.actor_id, movie_actors.c.movie_id))
+    movies = Adjacency(read_pairs(
+        movie_actors.c.movie_id, movie_actors.c.actor_id))
+
+    return CastingGraph(actors, movies, overlay_limit)
+
+
+def use_graph(function):
+    """Calls function with the graph while holding its lock.
+
+    The graph is built on first use and rebuilt after GRAPH_MAX_AGE
+    seconds to pick up links written by other processes. Links written
+    by this process are applied as soon as they are committed.
+    """
+    global _graph, _built_at
+
+    with _lock:
+        max_age = current_app.config['GRAPH_MAX_AGE']
+        if _graph is None or time.monotonic() - _built_at > max_age:
+            _graph = build_graph(
+                current_app.config['GRAPH_OVERLAY_LIMIT'])
+            _built_at = time.monotonic()
+        return function(_graph)
+
+
+def get_costars(actor_id):
+    """Returns the (co-star ID, shared Movies) of an Actor, most first."""
+    return use_graph(lambda graph: graph.get_costars(actor_id))
+
+
+def find_path(source_id, target_id):
+    """Returns the shortest (Actor IDs, Movie IDs) between two Actors."""
+    return use_graph(lambda graph: graph.find_path(source_id, target_id))
+
+
+@after_commit
+def update_graph(changes):
+    """Applies committed movie_actors inserts and deletes to the graph.
+
+    The graph is checked under the lock, so a commit made while another
+    thread builds it waits for the build and is then applied. Links and
+    unlinks are idempotent, so one the build already read is harmless.
+    """
+    with _lock:
+        if _graph is None:
+            return
+
+        for change in changes:
+            if change.table != 'movie_actors':
+                continue
+            if change.action == 'insert':
+                _graph.link(change.row['actor_id'], change.row['movie_id'])
+            elif change.action == 'delete':
+                _graph.unlink(change.row['actor_id'], change.row['movie_id'])
+        _graph.compact()
@@ -0,0 +1,50 @@
+"""Gunicorn settings, read from the working directory by `gunicorn wsgi:app`
+
+GUNICORN_PROFILE picks how each worker serves requests:
+- gthread (default): cores + 1 workers of GUNICORN_THREADS (4) threads.
+  A request waiting on the DB or on Auth0 only holds a thread, and the
+  threads of a worker share its caches and connection pool.
+- sync: 2 * cores + 1 single-threaded workers. Each request holds a
+  whole worker until it completes.
+
+WEB_CONCURRENCY overrides the number of workers, e.g. where the CPU
+count seen by the container is the host's.
+"""
+import multiprocessing
+import os
+
+from models import dispose_engines
+
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+cores = multiprocessing.cpu_count()
+
+if profile == 'gthread':
+    worker_class = 'gthread'
+    workers = cores + 1
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+elif profile == 'sync':
+    worker_class = 'sync'
+    workers = 2 * cores + 1
+else:
+    raise ValueError('Unknown GUNICORN_PROFILE: ' + profile)
+
+workers = int(os.environ.get('WEB_CONCURRENCY', workers))
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+
+# Reuse client connections, e.g. from the Heroku router, between requests
+keepalive = 5
+
+# Replace workers now and then so they do not grow, at staggered times
+max_requests = 1000
+max_requests_jitter = 100
+
+timeout = 30
+graceful_timeout = 30
+
+# Workers are forked from a parent that already created the app
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Drops any DB connection the worker inherited from the parent."""
+    dispose_engines(server.app.wsgi())
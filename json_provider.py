@@ -0,0 +1,105 @@
+import re
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Characters json.dumps escapes with ensure_ascii but orjson writes as
+# they are: DEL and everything beyond ASCII. In JSON text they only
+# appear inside strings, so escaping them afterwards is equivalent.
+NON_ASCII = re.compile(r'[^\x00-\x7e]')
+
+
+def escape_non_ascii(text):
+    """Escapes DEL and non-ASCII characters the way json.dumps does."""
+    def escape(match):
+        code = ord(match.group())
+        if code > 0xffff:
+            code -= 0x10000
+            return '\\u%04x\\u%04x' % (
+                0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+        return '\\u%04x' % code
+
+    return NON_ASCII.sub(escape, text)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Serializes JSON with orjson when it is installed.
+
+    The output is what DefaultJSONProvider writes: sorted keys, ASCII
+    only, and compact or indented by 2 like jsonify. Non-ASCII text and
+    DEL are escaped after orjson wrote them. Floats are the one difference in
+    bytes: orjson writes the same values without padding the exponent,
+    e.g. 1e-7 and 1e16 rather than 1e-07 and 1e+16. Dates are written as
+    YYYY-MM-DD, the same as str(date), so rows can be passed to jsonify
+    without converting their values first. Other separators, non-string
+    keys and integers beyond 64 bits are serialized by the standard
+    library instead.
+
+    Attributes:
+        fast: Whether orjson is used. FAST_JSON_ENABLED sets it, and it is
+              always False without orjson.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.fast = orjson is not None and \
+            app.config.get('FAST_JSON_ENABLED', True)
+
+    @staticmethod
+    def default(o):
+        """Writes dates as ISO 8601 instead of HTTP dates."""
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def get_option(self, kwargs):
+        """Returns the orjson option matching json.dumps arguments.
+
+        Returns:
+            The option flags, or None if orjson cannot produce the same
+            output, e.g. for the default ', ' separators without indent.
+        """
+        config = self._app.config
+        if not self.fast or self._app._json_encoder is not None or \
+                config['JSON_AS_ASCII'] is not None or \
+                config['JSON_SORT_KEYS'] is not None or \
+                not set(kwargs) <= {'indent', 'separators', 'sort_keys'}:
+            return None
+
+        indent = kwargs.get('indent')
+        separators = kwargs.get('separators')
+        if indent is None and separators == (',', ':'):
+            option = 0
+        elif indent == 2 and separators in (None, (',', ': ')):
+            option = orjson.OPT_INDENT_2
+        else:
+            return None
+
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        """Serializes data as JSON to a string, with orjson if possible.
+
+        Args:
+            obj: The data to serialize.
+            kwargs: Passed to json.dumps when orjson is not used.
+        """
+        option = self.get_option(kwargs)
+        if option is not None:
+            try:
+                data = orjson.dumps(obj, default=self.default, option=option)
+            except TypeError:
+                pass
+            else:
+                if not self.ensure_ascii or \
+                        data.isascii() and b'\x7f' not in data:
+                    return data.decode()
+                return escape_non_ascii(data.decode())
+
+        return super().dumps(obj, **kwargs)
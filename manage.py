@@ -1,14 +0,0 @@
-from flask_script import Manager
-from flask_migrate import Migrate, MigrateCommand
-from app import app
-from models import db
-
-"""Script to run Flask Migrate commands"""
-
-migrate = Migrate(app, db)
-manager = Manager(app)
-
-manager.add_command('db', MigrateCommand)
-
-if __name__ == '__main__':
-    manager.run()
@@ -0,0 +1,42 @@
+"""add text search indexes
+
+Revision ID: 3d519b1d139c
+Revises: ff1f2d717355
+Create Date: 2026-10-18 11:02:37.840391
+
+Only PostgreSQL is indexed here. The SQLite FTS5 tables are created by
+8b2e4f6a9c1d.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3d519b1d139c'
+down_revision = 'ff1f2d717355'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_actor_name_trgm '
+               'ON actor USING gin (name gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_movie_title_trgm '
+               'ON movie USING gin (title gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_actor_name_words '
+               "ON actor USING gin (to_tsvector('simple', name))")
+    op.execute('CREATE INDEX IF NOT EXISTS ix_movie_title_words '
+               "ON movie USING gin (to_tsvector('simple', title))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('DROP INDEX IF EXISTS ix_movie_title_words')
+    op.execute('DROP INDEX IF EXISTS ix_actor_name_words')
+    op.execute('DROP INDEX IF EXISTS ix_movie_title_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_actor_name_trgm')
@@ -0,0 +1,56 @@
+"""add sqlite search tables
+
+Revision ID: 8b2e4f6a9c1d
+Revises: c3f27e6eb01d
+Create Date: 2026-10-18 19:42:10.517302
+
+Creates the FTS5 tables that search.sync_search_index keeps current on
+SQLite, filled from the existing rows. search.create_search_index also
+creates them for new databases when DB_CREATE_SCHEMA is set, so each one
+is only created if missing. PostgreSQL is indexed by 3d519b1d139c.
+"""
+import sqlite3
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4f6a9c1d'
+down_revision = 'c3f27e6eb01d'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_COLUMNS = {'actor': 'name', 'movie': 'title'}
+
+# The same tables as search.SQLITE_INDEXES, as (suffix, options)
+SQLITE_INDEXES = [
+    ('words', "tokenize='unicode61', prefix='1 2'"),
+] + ([('trigrams', "tokenize='trigram'")]
+     if sqlite3.sqlite_version_info >= (3, 34) else [])
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+
+    existing = sa.inspect(bind).get_table_names()
+    for name, searched in SEARCH_COLUMNS.items():
+        for suffix, options in SQLITE_INDEXES:
+            fts = f'{name}_{suffix}'
+            if fts in existing:
+                continue
+            op.execute(f'CREATE VIRTUAL TABLE {fts} USING '
+                       f'fts5({searched}, {options})')
+            op.execute(f'INSERT INTO {fts} (rowid, {searched}) '
+                       f'SELECT id, {searched} FROM {name}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for name in reversed(list(SEARCH_COLUMNS)):
+        for suffix in ('trigrams', 'words'):
+            op.execute(f'DROP TABLE IF EXISTS {name}_{suffix}')
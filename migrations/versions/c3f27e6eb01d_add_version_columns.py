@@ -0,0 +1,64 @@
+"""add version columns
+
+Revision ID: c3f27e6eb01d
+Revises: 3d519b1d139c
+Create Date: 2026-10-18 15:21:44.105273
+
+Adds the version and updated_at columns of Movies and Actors and the
+table_version counters behind the ETags of GET responses. Existing rows
+start at version 1. db.create_all() also creates these for new
+databases, so each one is only created if missing.
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f27e6eb01d'
+down_revision = '3d519b1d139c'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['actor', 'movie']
+VERSIONED_TABLES = ['actor', 'movie', 'movie_actors']
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # SQLite cannot add a column with a non-constant default
+    if bind.dialect.name == 'sqlite':
+        now = sa.text("'%s'" % datetime.utcnow().isoformat(' '))
+    else:
+        now = sa.func.now()
+
+    for table in TABLES:
+        existing = [column['name'] for column in inspector.get_columns(table)]
+        if 'version' not in existing:
+            op.add_column(table, sa.Column(
+                'version', sa.Integer(), nullable=False, server_default='1'))
+        if 'updated_at' not in existing:
+            op.add_column(table, sa.Column(
+                'updated_at', sa.DateTime(), nullable=False,
+                server_default=now))
+
+    if 'table_version' not in inspector.get_table_names():
+        table_version = op.create_table(
+            'table_version',
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('name'))
+        op.bulk_insert(table_version, [
+            {'name': name, 'version': 0, 'updated_at': datetime.utcnow()}
+            for name in VERSIONED_TABLES])
+
+
+def downgrade():
+    op.drop_table('table_version')
+    for table in reversed(TABLES):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
@@ -0,0 +1,59 @@
+"""initial schema
+
+Revision ID: edaf0c94459d
+Revises: 
+Create Date: 2026-10-18 09:12:41.163520
+
+Databases created before migrations were tracked already have these
+tables from db.create_all(), so each one is only created if missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'edaf0c94459d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'movie' not in tables:
+        op.create_table(
+            'movie',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(), nullable=False),
+            sa.Column('release_date', sa.Date(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'actor' not in tables:
+        op.create_table(
+            'actor',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('age', sa.Integer(), nullable=False),
+            sa.Column('gender', sa.Enum('M', 'F', name='gender_types'),
+                      nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'movie_actors' not in tables:
+        op.create_table(
+            'movie_actors',
+            sa.Column('actor_id', sa.Integer(), nullable=False),
+            sa.Column('movie_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['actor_id'], ['actor.id'],
+                                    ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['movie_id'], ['movie.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('actor_id', 'movie_id')
+        )
+
+
+def downgrade():
+    op.drop_table('movie_actors')
+    op.drop_table('actor')
+    op.drop_table('movie')
+    sa.Enum(name='gender_types').drop(op.get_bind(), checkfirst=True)
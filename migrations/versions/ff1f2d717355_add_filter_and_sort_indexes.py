@@ -0,0 +1,38 @@
+"""add filter and sort indexes
+
+Revision ID: ff1f2d717355
+Revises: edaf0c94459d
+Create Date: 2026-10-18 09:40:05.512207
+
+db.create_all() also creates these indexes for new tables, so each one
+is only created if missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ff1f2d717355'
+down_revision = 'edaf0c94459d'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_actor_gender_age', 'actor', ['gender', 'age']),
+    ('ix_actor_name', 'actor', ['name']),
+    ('ix_movie_release_date', 'movie', ['release_date']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        existing = [index['name'] for index in inspector.get_indexes(table)]
+        if name not in existing:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -1,22 +1,179 @@
-import os
-from sqlalchemy import Column, String, Integer, Date, Enum
-from flask_sqlalchemy import SQLAlchemy
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, Date, DateTime, Enum, event, \
+    inspect, orm, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import selectinload, validates
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 
-database_path = os.environ['DATABASE_URL']
+from db_pool import get_engine_options, instrument_pool
 
-db = SQLAlchemy()
 
+class RoutingSession(SignallingSession):
+    """A session that can run the queries of a request on a replica.
 
-def setup_db(app, database_path=database_path):
-    """Binds a Flask App and a SQLAlchemy service"""
+    The 'db_router' extension of the app, added by setup_replicas, picks
+    the replica. Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('db_router')
+        if router is not None and not self._flushing:
+            engine = router.get_read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that may read from replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+logger = logging.getLogger(__name__)
+
+# Cached row counts per table name as (count, time fetched)
+_total_cache = {}
+
+# Callables registered with after_setup, after_flush and after_commit
+_setup_hooks = []
+_flush_listeners = []
+_commit_listeners = []
+
+
+def setup_db(app, database_path=None):
+    """Binds a Flask App and a SQLAlchemy service
+
+    The database defaults to the DATABASE_URL of the app config, and the
+    connection pool is configured by its DB_POOL_* settings. The schema
+    is only created when DB_CREATE_SCHEMA is set, otherwise it is left
+    to the migrations.
+    """
+    database_path = database_path or app.config['DATABASE_URL']
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    engine_options = get_engine_options(app.config, database_path)
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if 'poolclass' in engine_options:
+        instrument_pool(db.get_engine(app))
+    if app.config['DB_CREATE_SCHEMA']:
+        create_schema(app)
+
+
+def dispose_engines(app):
+    """Empties the connection pools of the primary and of the replicas.
+
+    Servers call it in each forked worker, so that the worker opens its
+    own connections rather than sharing those of the parent.
+    """
+    for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+        db.get_engine(app, bind).dispose()
+
+
+def create_schema(app):
+    """Creates the tables and the DB objects of the after_setup hooks.
+
+    The pool is emptied afterwards, so that processes forked from this
+    one do not share its connections.
+    """
+    db.create_all(bind=None, app=app)
+    engine = db.get_engine(app)
+    for hook in _setup_hooks:
+        hook(engine)
+    engine.dispose()
+
+
+def after_setup(hook):
+    """Registers a callable run with the engine once setup_db is done.
+
+    Used to create DB objects that db.create_all() does not manage.
+    """
+    _setup_hooks.append(hook)
+    return hook
+
+
+def after_flush(listener):
+    """Registers a listener for changes as they are flushed to the DB.
+
+    The listener is called as listener(session, changes) inside the
+    transaction, so it may execute SQL that must commit with the changes.
+    """
+    _flush_listeners.append(listener)
+    return listener
+
+
+def after_commit(listener):
+    """Registers a listener for changes once they are committed.
+
+    The listener is called as listener(changes) with the Changes of each
+    commit. It must not use the session.
+    """
+    _commit_listeners.append(listener)
+    return listener
+
+
+def commit():
+    """Commits the session, unless a unit of work commits it later.
+
+    Within the unit of work of a request the session is only flushed, so
+    that new IDs and constraint errors are still known right away, and
+    the request commits once when it ends.
+    """
+    if db.session.info.get('unit_of_work'):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def get_total(model):
+    """Returns the number of rows in the table for the model.
+
+    The COUNT is cached for COUNT_CACHE_TTL seconds and is dropped
+    whenever a row of the model is inserted or deleted.
+
+    Args:
+        model: The Movie or Actor class.
+    """
+    cached = _total_cache.get(model.__tablename__)
+    ttl = current_app.config['COUNT_CACHE_TTL']
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+
+    total = db.session.query(db.func.count(model.id)).scalar()
+    _total_cache[model.__tablename__] = (total, time.monotonic())
+    return total
+
+
+@after_commit
+def clear_totals(changes):
+    """Drops the cached row counts of tables with inserts or deletes."""
+    for change in changes:
+        if change.action != 'update':
+            _total_cache.pop(change.table, None)
 
 
 """Creates a many-to-many association for Movies and Actors"""
+def parse_date(value):
+    """Parses a date like the 'date' format of the JSON schemas.
+
+    It accepts dates without leading zeros, such as '2020-1-5', which
+    date.fromisoformat rejects.
+
+    Raises:
+        ValueError: If the value is not a YYYY-MM-DD date.
+    """
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
 movie_actors = db.Table(
     'movie_actors', db.Column(
         'actor_id', db.Integer, db.ForeignKey(
@@ -25,6 +182,15 @@ movie_actors = db.Table(
                     'movie.id', ondelete='CASCADE'), primary_key=True))
 
 
+"""Counts the writes to each table, bumped with every flush"""
+table_versions = db.Table(
+    'table_version',
+    db.Column('name', db.String, primary_key=True),
+    db.Column('version', db.Integer, nullable=False, default=0),
+    db.Column('updated_at', db.DateTime, nullable=False,
+              default=datetime.utcnow))
+
+
 class Movie(db.Model):
     """A class to represent a Movie
 
@@ -32,24 +198,49 @@ class Movie(db.Model):
         id: Primary key in the DB
         title: The title of the Movie
         release_date: The release date of the Movie
+        version: The number of times the Movie was updated, plus one
+        updated_at: The UTC time the Movie was last inserted or updated
         actors: A list of actors associated to the Movie
+        fields: Attribute names keyed by their JSON representation
+        sortable: Attributes that list results can be sorted on
+        filters: Attributes and comparisons keyed by query string
     """
     __tablename__ = 'movie'
+    __table_args__ = (
+        db.Index('ix_movie_release_date', 'release_date'),
+    )
+    fields = {'id': 'id', 'title': 'title', 'releaseDate': 'release_date'}
+    sortable = ('id', 'title', 'release_date')
+    filters = {
+        'released_after': ('release_date', '>='),
+        'released_before': ('release_date', '<=')
+    }
 
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     release_date = Column(Date, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     actors = db.relationship(
         'Actor',
         secondary=movie_actors,
         back_populates='movies',
-        cascade='all, delete',
         passive_deletes=True)
 
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    @validates('release_date')
+    def validate_release_date(self, key, value):
+        """Stores an ISO date string as a date, parsed by parse_date.
+
+        The commit listeners then see the date the database stores.
+        """
+        if isinstance(value, str):
+            return parse_date(value)
+        return value
+
     def get_data(self):
         """Returns a dictionary representation of the Movie"""
         return {
@@ -58,6 +249,18 @@ class Movie(db.Model):
             'releaseDate': str(self.release_date)
         }
 
+    @classmethod
+    def get_with_actors(cls, movie_id):
+        """Fetches a Movie with its Actors loaded by one extra query.
+
+        Args:
+            movie_id: The primary key for the Movie.
+
+        Returns:
+            The Movie, or None if not found.
+        """
+        return cls.query.options(selectinload(cls.actors)).get(movie_id)
+
     def get_data_with_actors(self):
         """Returns a dictionary representation of the Movie with Actors."""
         formatted_actors = [actor.get_data() for actor in self.actors]
@@ -72,16 +275,16 @@ class Movie(db.Model):
     def insert(self):
         """Inserts the Movie into the DB"""
         db.session.add(self)
-        db.session.commit()
+        commit()
 
     def update(self):
         """Updates the DB with the current representation of the Movie"""
-        db.session.commit()
+        commit()
 
     def delete(self):
         """Deletes the Movie from the DB"""
         db.session.delete(self)
-        db.session.commit()
+        commit()
 
 
 class Actor(db.Model):
@@ -92,19 +295,36 @@ class Actor(db.Model):
         name: The name of the Actor
         age: The age of the Actor in years
         gender: The gender of the Actor, 'M' or 'F'
+        version: The number of times the Actor was updated, plus one
+        updated_at: The UTC time the Actor was last inserted or updated
         movies: A list of Movies associated to the Actor
+        fields: Attribute names keyed by their JSON representation
+        sortable: Attributes that list results can be sorted on
+        filters: Attributes and comparisons keyed by query string
     """
     __tablename__ = 'actor'
+    __table_args__ = (
+        db.Index('ix_actor_gender_age', 'gender', 'age'),
+        db.Index('ix_actor_name', 'name'),
+    )
+    fields = {'id': 'id', 'name': 'name', 'age': 'age', 'gender': 'gender'}
+    sortable = ('id', 'name', 'age')
+    filters = {
+        'gender': ('gender', '=='),
+        'age_min': ('age', '>='),
+        'age_max': ('age', '<=')
+    }
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     age = Column(Integer, nullable=False)
     gender = Column(Enum('M', 'F', name='gender_types'))
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     movies = db.relationship(
         'Movie',
         secondary=movie_actors,
         back_populates='actors',
-        cascade='all, delete',
         passive_deletes=True)
 
     def __init__(self, name, age, gender):
@@ -121,6 +341,18 @@ class Actor(db.Model):
             'gender': self.gender
         }
 
+    @classmethod
+    def get_with_movies(cls, actor_id):
+        """Fetches an Actor with its Movies loaded by one extra query.
+
+        Args:
+            actor_id: The primary key for the Actor.
+
+        Returns:
+            The Actor, or None if not found.
+        """
+        return cls.query.options(selectinload(cls.movies)).get(actor_id)
+
     def get_data_with_movies(self):
         """Returns a dictionary representation of the Actor with Movies."""
         formatted_movies = [movie.get_data() for movie in self.movies]
@@ -136,13 +368,268 @@ class Actor(db.Model):
     def insert(self):
         """Inserts the Actor into the DB"""
         db.session.add(self)
-        db.session.commit()
+        commit()
 
     def update(self):
         """Updates the DB with the current representation of the Actor"""
-        db.session.commit()
+        commit()
 
     def delete(self):
         """Deletes the Actor from the DB"""
         db.session.delete(self)
-        db.session.commit()
+        commit()
+
+
+class Change(object):
+    """A committed change to a row of the movie, actor or movie_actors tables.
+
+    Attributes:
+        table: The name of the table.
+        action: 'insert', 'update' or 'delete'.
+        row: Column values of the row keyed by attribute name. Holds the
+             values from before the change for a delete.
+        old: Previous values of the columns changed by an update.
+        committed_at: The time.monotonic() just after the commit, set
+                      before the commit listeners are called.
+    """
+
+    def __init__(self, table, action, row, old=None):
+        self.table = table
+        self.action = action
+        self.row = row
+        self.old = old or {}
+        self.committed_at = None
+
+    def __repr__(self):
+        return '<Change %s %s %r>' % (self.action, self.table, self.row)
+
+
+def record_changes(session, changes):
+    """Notifies listeners of changes made without the ORM unit of work.
+
+    Bulk Core statements use this so the flush listeners run in their
+    transaction and the commit listeners run once it commits.
+    """
+    for listener in _flush_listeners:
+        listener(session, changes)
+    session.info.setdefault('changes', []).extend(changes)
+
+
+def update_links(model, item_id, added=(), removed=()):
+    """Adds and removes movie_actors rows of a Movie or Actor.
+
+    Only the rows for the given IDs are read and written and the
+    relationship collection is never loaded, so the cost depends on the
+    size of the change and not on the size of the collection. Removals
+    are applied after additions.
+
+    Args:
+        model: The Movie or Actor class of the item.
+        item_id: The primary key of the Movie or Actor.
+        added: IDs of existing related rows to link to the item.
+        removed: IDs of related rows to unlink from the item.
+
+    Returns:
+        A tuple of (IDs linked, IDs unlinked), leaving out the IDs that
+        were already in the requested state.
+    """
+    local = movie_actors.c[model.__tablename__ + '_id']
+    remote = next(c for c in movie_actors.c if c is not local)
+
+    ids = set(added) | set(removed)
+    existing = set()
+    if ids:
+        existing = {row[0] for row in db.session.execute(
+            select([remote]).where(local == item_id).where(
+                remote.in_(ids)))}
+
+    removed = set(removed)
+    linked = [id for id in dict.fromkeys(added)
+              if id not in existing and id not in removed]
+    unlinked = [id for id in dict.fromkeys(removed) if id in existing]
+
+    if linked:
+        # A concurrent request may have linked the same rows
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            statement = postgresql.insert(
+                movie_actors).on_conflict_do_nothing()
+        elif dialect == 'sqlite':
+            statement = movie_actors.insert().prefix_with('OR IGNORE')
+        else:
+            statement = movie_actors.insert()
+        db.session.execute(statement, [
+            {local.name: item_id, remote.name: id} for id in linked])
+    if unlinked:
+        db.session.execute(movie_actors.delete().where(
+            local == item_id).where(remote.in_(unlinked)))
+
+    changes = [
+        Change('movie_actors', action, {local.name: item_id, remote.name: id})
+        for action, ids in [('insert', linked), ('delete', unlinked)]
+        for id in ids]
+    if changes:
+        record_changes(db.session, changes)
+
+    return linked, unlinked
+
+
+def get_row(instance):
+    """Returns the column values of a Movie or Actor.
+
+    Expired attributes are loaded, so it must not be used after a commit.
+    """
+    mapper = inspect(instance).mapper
+    return {attr.key: getattr(instance, attr.key)
+            for attr in mapper.column_attrs}
+
+
+def get_link_changes(instance):
+    """Returns Changes for movie_actors rows added or removed in memory."""
+    state = inspect(instance)
+    changes = []
+    for rel in state.mapper.relationships:
+        if rel.secondary is not movie_actors:
+            continue
+
+        local_key = rel.synchronize_pairs[0][1].name
+        remote_key = rel.secondary_synchronize_pairs[0][1].name
+        history = state.attrs[rel.key].history
+        for action, related in [('insert', history.added or ()),
+                                ('delete', history.deleted or ())]:
+            for other in related:
+                changes.append(Change('movie_actors', action, {
+                    local_key: instance.id,
+                    remote_key: other.id
+                }))
+
+    return changes
+
+
+@event.listens_for(db.session, 'before_flush')
+def capture_deletes(session, flush_context, instances):
+    """Records rows and links of deleted Movies and Actors.
+
+    The rows are read before they are deleted, and the movie_actors rows
+    which the DB removes with ON DELETE CASCADE are looked up.
+    """
+    pending = session.info.setdefault('flushed_deletes', [])
+    for instance in session.deleted:
+        if not isinstance(instance, (Movie, Actor)):
+            continue
+
+        row = get_row(instance)
+        pending.append(Change(instance.__tablename__, 'delete', row))
+
+        column = movie_actors.c[instance.__tablename__ + '_id']
+        links = session.execute(
+            movie_actors.select().where(column == row['id']))
+        for link in links:
+            pending.append(Change('movie_actors', 'delete', dict(link)))
+
+
+@event.listens_for(db.session, 'before_flush')
+def bump_versions(session, flush_context, instances):
+    """Increments the version of Movies and Actors with changed columns."""
+    now = datetime.utcnow()
+    for instance in session.dirty:
+        if isinstance(instance, (Movie, Actor)) and session.is_modified(
+                instance, include_collections=False):
+            instance.version += 1
+            instance.updated_at = now
+
+
+@event.listens_for(db.session, 'after_flush')
+def capture_changes(session, flush_context):
+    """Collects the Changes of a flush and runs the flush listeners."""
+    changes = session.info.pop('flushed_deletes', [])
+    seen = set()
+    for instance in list(session.new) + list(session.dirty):
+        if not isinstance(instance, (Movie, Actor)):
+            continue
+
+        state = inspect(instance)
+        if instance in session.new:
+            changes.append(Change(
+                instance.__tablename__, 'insert', get_row(instance)))
+        elif session.is_modified(instance, include_collections=False):
+            old = {}
+            for attr in state.mapper.column_attrs:
+                history = state.attrs[attr.key].history
+                if history.has_changes() and history.deleted:
+                    old[attr.key] = history.deleted[0]
+            changes.append(Change(
+                instance.__tablename__, 'update', get_row(instance), old))
+
+        # Both sides of the relationship can hold the same link
+        for change in get_link_changes(instance):
+            key = (change.action, change.row['actor_id'],
+                   change.row['movie_id'])
+            if key not in seen:
+                seen.add(key)
+                changes.append(change)
+
+    if changes:
+        record_changes(session, changes)
+
+
+def get_savepoint(session):
+    """Returns the innermost savepoint of the session, or None."""
+    transaction = session.transaction
+    while transaction is not None and not transaction.nested:
+        transaction = transaction.parent
+    return transaction
+
+
+@event.listens_for(db.session, 'after_transaction_create')
+def mark_savepoint(session, transaction):
+    """Records how many Changes were made before a savepoint."""
+    if transaction.nested:
+        session.info.setdefault('savepoints', {})[transaction] = len(
+            session.info.get('changes', []))
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def unmark_savepoint(session, transaction):
+    """Forgets a savepoint once it is released or rolled back."""
+    if transaction.nested:
+        session.info.get('savepoints', {}).pop(transaction, None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def dispatch_changes(session):
+    """Runs the commit listeners with the Changes of the commit.
+
+    A released savepoint keeps its Changes for the enclosing commit. The
+    commit has already happened, so a listener that raises is logged and
+    the other listeners still run.
+    """
+    if get_savepoint(session) is not None:
+        return
+
+    changes = session.info.pop('changes', [])
+    if changes:
+        committed_at = time.monotonic()
+        for change in changes:
+            change.committed_at = committed_at
+        for listener in _commit_listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception('Commit listener %r failed', listener)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changes(session):
+    """Drops the Changes of a transaction that was rolled back.
+
+    Rolling back a savepoint only drops the Changes made since it began.
+    """
+    session.info.pop('flushed_deletes', None)
+    savepoint = get_savepoint(session)
+    if savepoint is None:
+        session.info.pop('changes', None)
+        return
+
+    count = session.info.get('savepoints', {}).get(savepoint, 0)
+    del session.info.get('changes', [])[count:]
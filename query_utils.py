@@ -0,0 +1,423 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import date
+from flask import request, abort, current_app
+from sqlalchemy import Date, Enum, Integer, tuple_
+
+from models import parse_date
+
+
+def get_pagination_args():
+    """Parses the 'page' and 'per_page' query strings of the request.
+
+    'per_page' defaults to ITEMS_PER_PAGE and may not exceed
+    MAX_ITEMS_PER_PAGE from the app config. A 'page' lower than 1 is
+    read as the first page.
+
+    Returns:
+        A tuple of (page, per_page).
+
+    Raises:
+        HTTPException: 400 if 'per_page' is out of range.
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get(
+        'per_page', current_app.config['ITEMS_PER_PAGE'], type=int)
+
+    if per_page < 1 or per_page > current_app.config['MAX_ITEMS_PER_PAGE']:
+        abort(400)
+
+    return max(page, 1), per_page
+
+
+def get_fields_args(model, relations=()):
+    """Parses the comma separated 'fields' query string of the request.
+
+    Args:
+        model: The Movie or Actor class.
+        relations: Names of related collections that may also be requested.
+
+    Returns:
+        A list of the requested JSON keys, or all of the model's fields
+        and relations if the query string is not present.
+
+    Raises:
+        HTTPException: 400 if an unknown field is requested.
+    """
+    fields = request.args.get('fields', None)
+    if fields is None:
+        return list(model.fields) + list(relations)
+
+    fields = [field for field in fields.split(',') if field]
+    for field in fields:
+        if field not in model.fields and field not in relations:
+            abort(400)
+
+    return fields
+
+
+def project(query, model, fields, *keys):
+    """Selects only the columns for the requested fields.
+
+    The query returns plain rows instead of hydrated model instances.
+
+    Args:
+        query: A query for the model.
+        model: The Movie or Actor class.
+        fields: JSON keys from get_fields_args.
+        *keys: Attribute names to select even if they were not requested.
+    """
+    names = [model.fields[field] for field in fields if field in model.fields]
+    names += [key for key in keys if key not in names]
+
+    return query.with_entities(*[getattr(model, name) for name in names])
+
+
+def format_row(model, row, fields):
+    """Returns a dictionary representation of a row from project.
+
+    Dates are left to the app's JSONProvider, which writes them the same
+    way as str(date).
+    """
+    return {field: getattr(row, model.fields[field])
+            for field in fields if field in model.fields}
+
+
+def format_rows(model, rows, fields):
+    """Returns the dictionary representations of rows from project.
+
+    project selects the requested columns first and in the order of
+    fields, so each row is zipped with the field names once instead of
+    looking up every column by name.
+    """
+    keys = [field for field in fields if field in model.fields]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def get_item(model, item_id, relation):
+    """Fetches a formatted row and its related rows for a detail endpoint.
+
+    Only the columns for the 'fields' query string are selected, and
+    the related rows are only queried if the relation is requested.
+
+    Args:
+        model: The Movie or Actor class.
+        item_id: The primary key of the row.
+        relation: The name of the model's many-to-many relationship.
+
+    Returns:
+        A dictionary representation of the row, or None if not found.
+
+    Raises:
+        HTTPException: 400 if an unknown field is requested.
+    """
+    fields = get_fields_args(model, [relation])
+    row = project(model.query, model, fields, 'id').filter(
+        model.id == item_id).first()
+    if row is None:
+        return None
+
+    data = format_row(model, row, fields)
+    if relation in fields:
+        prop = getattr(model, relation).property
+        related = prop.mapper.class_
+        related_fields = list(related.fields)
+        owner_column = prop.synchronize_pairs[0][1]
+
+        query = project(related.query, related, related_fields).join(
+            prop.secondary, prop.secondaryjoin).filter(
+            owner_column == item_id).order_by(related.id)
+        data[relation] = [format_row(related, related_row, related_fields)
+                          for related_row in query]
+
+    return data
+
+
+def parse_value(column, value):
+    """Converts a query string value to the Python type of the column.
+
+    Raises:
+        ValueError: If the value is not valid for the column.
+    """
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Date):
+        return parse_date(value)
+    if isinstance(column.type, Enum) and value not in column.type.enums:
+        raise ValueError(value)
+
+    return value
+
+
+def filter_query(query, model):
+    """Applies the model's filters found in the query strings of the request.
+
+    Args:
+        query: A query for the model.
+        model: The Movie or Actor class.
+
+    Returns:
+        A tuple of (filtered query, True if any filter was applied).
+
+    Raises:
+        HTTPException: 400 if a filter value is not valid.
+    """
+    filtered = False
+    for arg, (key, operator) in model.filters.items():
+        value = request.args.get(arg, None)
+        if value is None:
+            continue
+
+        column = getattr(model, key)
+        try:
+            value = parse_value(column, value)
+        except ValueError:
+            abort(400)
+
+        if operator == '>=':
+            query = query.filter(column >= value)
+        elif operator == '<=':
+            query = query.filter(column <= value)
+        else:
+            query = query.filter(column == value)
+        filtered = True
+
+    return query, filtered
+
+
+def get_by_ids(query, model, ids):
+    """Fetches the rows of a query with the given IDs.
+
+    The IDs are resolved with IN (...) queries of at most ID_CHUNK_SIZE
+    IDs each, so a long list costs a few round trips instead of one per ID.
+
+    Args:
+        query: A query for the model, or a projection of it with the ID.
+        model: The Movie or Actor class.
+        ids: The primary keys to fetch.
+
+    Returns:
+        A tuple of (rows keyed by ID, IDs that were not found in the
+        order they were given).
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    chunk_size = current_app.config['ID_CHUNK_SIZE']
+
+    rows = {}
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        for row in query.filter(model.id.in_(chunk)):
+            rows[row.id] = row
+
+    return rows, [id for id in unique_ids if id not in rows]
+
+
+def get_ids_args():
+    """Parses the comma separated 'ids' query string of the request.
+
+    Returns:
+        A list of the requested IDs, or None if the query string is not
+        present.
+
+    Raises:
+        HTTPException: 400 if an ID is not an integer or more than
+                       MAX_IDS_PER_REQUEST IDs are requested.
+    """
+    ids = request.args.get('ids', None)
+    if ids is None:
+        return None
+
+    try:
+        ids = [int(id) for id in ids.split(',') if id]
+    except ValueError:
+        abort(400)
+    if len(ids) > current_app.config['MAX_IDS_PER_REQUEST']:
+        abort(400)
+
+    return ids
+
+
+def get_items(model, ids):
+    """Fetches formatted rows for a list of IDs in one query.
+
+    Args:
+        model: The Movie or Actor class.
+        ids: The primary keys from get_ids_args.
+
+    Returns:
+        A tuple of (rows in the order of their IDs, IDs that were not
+        found).
+
+    Raises:
+        HTTPException: 400 if an unknown field is requested.
+    """
+    fields = get_fields_args(model)
+    query = project(model.query, model, fields, 'id')
+    rows, not_found = get_by_ids(query, model, ids)
+
+    return format_rows(model, [rows[id] for id in ids if id in rows],
+                       fields), not_found
+
+
+def get_sort_args(model):
+    """Parses the 'sort' query string of the request.
+
+    The value is one of the model's sortable attributes, prefixed with
+    '-' for descending order. Defaults to ascending ID.
+
+    Args:
+        model: The Movie or Actor class.
+
+    Returns:
+        A tuple of (attribute name, descending).
+
+    Raises:
+        HTTPException: 400 if the attribute cannot be sorted on.
+    """
+    sort = request.args.get('sort', 'id')
+    descending = sort.startswith('-')
+    key = sort[1:] if descending else sort
+    if key not in model.sortable:
+        abort(400)
+
+    return key, descending
+
+
+def sort_query(query, model, key, descending):
+    """Orders a query by the sort key with a tiebreak on ID."""
+    columns = [getattr(model, key), model.id]
+    if key == 'id':
+        columns = [model.id]
+    if descending:
+        columns = [column.desc() for column in columns]
+
+    return query.order_by(*columns)
+
+
+def encode_cursor(model, key, descending, last):
+    """Builds an opaque cursor for the row after the last one returned.
+
+    Args:
+        model: The Movie or Actor class.
+        key: The attribute the results are sorted on.
+        descending: True if the results are in descending order.
+        last: The last Movie or Actor on the current page.
+    """
+    value = getattr(last, key)
+    if isinstance(value, date):
+        value = value.isoformat()
+    sort = ('-' if descending else '') + key
+    data = json.dumps([model.__tablename__, sort, value, last.id])
+
+    return urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(model, key, descending, cursor):
+    """Reads the sort key and ID of the last seen row from a cursor.
+
+    Returns:
+        A tuple of (sort key value, ID).
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed, was issued for
+                       another table or sort order, or holds values of
+                       the wrong types for the sort key and ID.
+    """
+    column_type = getattr(model, key).type
+    try:
+        table, sort, value, last_id = json.loads(urlsafe_b64decode(cursor))
+        if isinstance(column_type, Date):
+            value = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+    if table != model.__tablename__ or \
+            sort != ('-' if descending else '') + key:
+        abort(400)
+
+    # Anything else would be bound into the keyset condition as is
+    for item, expected in [(value, column_type.python_type),
+                           (last_id, int)]:
+        if isinstance(item, bool) or not isinstance(item, expected):
+            abort(400)
+
+    return value, last_id
+
+
+def seek(query, model, key, descending, cursor):
+    """Applies the keyset condition and limit for a cursor page.
+
+    Rows are located with WHERE (sort key, id) > (last value, last id)
+    so the cost of a page does not depend on how deep it is.
+
+    Args:
+        query: A query ordered with sort_query.
+        model: The Movie or Actor class.
+        key: The attribute the results are sorted on.
+        descending: True if the results are in descending order.
+        cursor: A cursor from encode_cursor, or '' for the first page.
+
+    Returns:
+        A tuple of (rows, next cursor). The next cursor is None on the
+        last page.
+    """
+    _, per_page = get_pagination_args()
+
+    if cursor:
+        value, last_id = decode_cursor(model, key, descending, cursor)
+        if key == 'id':
+            seen, last = model.id, last_id
+        else:
+            seen = tuple_(getattr(model, key), model.id)
+            last = tuple_(value, last_id)
+        query = query.filter(seen < last if descending else seen > last)
+
+    rows = query.limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    return rows, encode_cursor(model, key, descending, rows[-1])
+
+
+def get_page(query, model, total):
+    """Fetches the requested page of a list endpoint.
+
+    A 'cursor' query string selects keyset pagination, otherwise the
+    'page' query string is used with LIMIT/OFFSET. Only the columns for
+    the 'fields' query string are selected.
+
+    Args:
+        query: An unordered query for the model.
+        model: The Movie or Actor class.
+        total: The total number of rows the query can return.
+
+    Returns:
+        A tuple of (formatted rows, next cursor). The next cursor is
+        always None when paginating by page number.
+
+    Raises:
+        HTTPException: 400 if an unknown field is requested,
+                       404 if the requested page is past the last page.
+    """
+    fields = get_fields_args(model)
+    key, descending = get_sort_args(model)
+    query = project(query, model, fields, 'id', key)
+    query = sort_query(query, model, key, descending)
+
+    rows, next_cursor = get_rows(query, model, key, descending, total)
+    return format_rows(model, rows, fields), next_cursor
+
+
+def get_rows(query, model, key, descending, total):
+    """Fetches the rows of the requested page from a sorted query."""
+    cursor = request.args.get('cursor', None)
+    if cursor is not None:
+        return seek(query, model, key, descending, cursor)
+
+    page, per_page = get_pagination_args()
+    start = (page - 1) * per_page
+    if start > total:
+        abort(404)
+
+    return query.limit(per_page).offset(start).all(), None
@@ -1,24 +1,155 @@
+import os
 import json
 from functools import wraps
-from jsonschema import validate, FormatChecker
+from jsonschema import Draft7Validator, FormatChecker
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 from flask import request
 
+# The schemas/ directory next to this module, wherever the app is run from
+SCHEMA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'schemas')
 
-def get_schemas():
-    """Returns a dictionary of JSON schemas from the schemas/ directory."""
-    schemas = {}
+FORMAT_CHECKER = FormatChecker()
+
+
+def get_property_check(schema):
+    """Compiles the schema of a property into a function.
+
+    Only the keywords of the properties in schemas/ are supported.
+
+    Returns:
+        A function returning True if a value is valid against the schema,
+        or None if the schema has other keywords.
+    """
+    keywords = set(schema) - {'description'}
+    schema_type = schema.get('type')
+
+    if schema_type == 'string' and keywords <= {'type', 'enum', 'format'}:
+        enum = schema.get('enum')
+        if enum is not None and not all(type(item) is str for item in enum):
+            return None
+        enum = set(enum) if enum is not None else None
+        value_format = schema.get('format')
+        if value_format is not None and \
+                value_format not in FORMAT_CHECKER.checkers:
+            return None
+
+        def check_string(value):
+            return type(value) is str and (
+                enum is None or value in enum) and (
+                value_format is None or
+                FORMAT_CHECKER.conforms(value, value_format))
+        return check_string
+
+    if schema_type == 'integer' and keywords == {'type'}:
+        return lambda value: type(value) is int
+
+    if schema_type == 'array' and keywords == {'type', 'items'} and \
+            schema['items'] == {'type': 'integer'}:
+        return lambda value: type(value) is list and all(
+            type(item) is int for item in value)
+
+    return None
+
+
+def get_fast_path(schema):
+    """Compiles a flat object schema into a function.
+
+    The function only answers whether an instance is valid, which is
+    cheaper than collecting errors with a jsonschema validator. It is
+    strict: a value it does not recognize, such as 1.0 for an integer,
+    is reported as invalid and left to the full validator.
+
+    Returns:
+        A function returning True if an instance is valid against the
+        schema, or None if the schema has keywords it does not support.
+    """
+    keywords = set(schema) - {'$schema', 'title', 'description'}
+    if schema.get('type') != 'object' or \
+            not keywords <= {'type', 'properties', 'required',
+                             'maxProperties'}:
+        return None
 
-    with open('schemas/post_actor.json') as f:
-        schemas['post_actor'] = json.load(f)
+    checks = {}
+    for name, property_schema in schema.get('properties', {}).items():
+        checks[name] = get_property_check(property_schema)
+        if checks[name] is None:
+            return None
+    required = schema.get('required', [])
+    max_properties = schema.get('maxProperties')
 
-    with open('schemas/post_movie.json') as f:
-        schemas['post_movie'] = json.load(f)
+    def is_valid(instance):
+        if type(instance) is not dict:
+            return False
+        if max_properties is not None and len(instance) > max_properties:
+            return False
+        for name in required:
+            if name not in instance:
+                return False
+        for name, value in instance.items():
+            check = checks.get(name)
+            if check is not None and not check(value):
+                return False
+        return True
 
-    with open('schemas/patch_actor.json') as f:
-        schemas['patch_actor'] = json.load(f)
+    return is_valid
 
-    with open('schemas/patch_movie.json') as f:
-        schemas['patch_movie'] = json.load(f)
+
+class SchemaValidator(object):
+    """A JSON schema with its validator compiled once.
+
+    The schema is checked against its metaschema when the validator is
+    built rather than on every request.
+
+    Attributes:
+        schema: The JSON schema.
+        validator: The jsonschema validator of the schema.
+        fast_path: A function from get_fast_path accepting valid
+                   instances before the validator runs, or None.
+    """
+
+    def __init__(self, schema, fast_path=True):
+        cls = validator_for(schema, default=Draft7Validator)
+        cls.check_schema(schema)
+        self.schema = schema
+        self.validator = cls(schema, format_checker=FORMAT_CHECKER)
+        self.fast_path = get_fast_path(schema) if fast_path else None
+
+    def iter_errors(self, instance):
+        """Yields the validation errors of an instance."""
+        if self.fast_path is not None and self.fast_path(instance):
+            return iter(())
+        return self.validator.iter_errors(instance)
+
+    def validate(self, instance):
+        """Validates an instance like jsonschema.validate.
+
+        Raises:
+            ValidationError: The most relevant error of the instance.
+        """
+        error = best_match(self.iter_errors(instance))
+        if error is not None:
+            raise error
+
+
+def get_schemas(fast_path=True):
+    """Returns the SchemaValidators of the schemas/ directory.
+
+    Args:
+        fast_path: Whether to compile fast paths for the flat schemas.
+
+    Returns:
+        A dictionary of SchemaValidators keyed by file name without the
+        .json extension, e.g. 'post_actor'.
+    """
+    schemas = {}
+    for file_name in sorted(os.listdir(SCHEMA_DIR)):
+        name, extension = os.path.splitext(file_name)
+        if extension != '.json':
+            continue
+        with open(os.path.join(SCHEMA_DIR, file_name)) as f:
+            schemas[name] = SchemaValidator(json.load(f), fast_path)
 
     return schemas
 
@@ -27,17 +158,21 @@ def schema_validator(schema=''):
     """Decorator to validate JSON request bodies against the schema
 
     Args:
-        schema: The JSON schema with which to validate the request body.
+        schema: The SchemaValidator, or the JSON schema, with which to
+                validate the request body.
 
     Raises:
         ValidationError: An error occurred validating the JSON request body
                          against the schema.
     """
+    if not isinstance(schema, SchemaValidator):
+        schema = SchemaValidator(schema)
+
     def schema_validator_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             request_json = request.get_json()
-            validate(request_json, schema, format_checker=FormatChecker())
+            schema.validate(request_json)
             return f(*args, **kwargs)
 
         return wrapper
@@ -0,0 +1,177 @@
+import sqlite3
+import warnings
+from sqlalchemy import column, func, literal, literal_column, or_, table, \
+    text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, after_setup, after_flush
+from query_utils import project
+
+# Searchable column for each table name
+SEARCH_COLUMNS = {'actor': 'name', 'movie': 'title'}
+
+# Terms shorter than a trigram are matched against the start of words
+MIN_SUBSTRING_LENGTH = 3
+
+# FTS5 only matches substrings with the trigram tokenizer (SQLite 3.34+)
+SQLITE_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+# FTS5 tables for each table name as (suffix, options)
+SQLITE_INDEXES = [
+    ('words', "tokenize='unicode61', prefix='1 2'"),
+] + ([('trigrams', "tokenize='trigram'")] if SQLITE_TRIGRAM else [])
+
+# Expression indexes for each table name and column as (suffix, expression)
+POSTGRES_INDEXES = [
+    ('trgm', '{column} gin_trgm_ops'),
+    ('words', "to_tsvector('simple', {column})"),
+]
+
+
+@after_setup
+def create_search_index(engine):
+    """Creates the text search indexes for names and titles.
+
+    PostgreSQL uses GIN indexes on pg_trgm trigrams and on a 'simple'
+    tsvector of words, which the DB keeps current by itself. SQLite uses
+    FTS5 tables kept current by sync_search_index. Other DBs fall back to
+    unindexed LIKE queries.
+    """
+    if engine.dialect.name == 'postgresql':
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                for name, searched in SEARCH_COLUMNS.items():
+                    for suffix, expression in POSTGRES_INDEXES:
+                        connection.execute(text(
+                            f'CREATE INDEX IF NOT EXISTS '
+                            f'ix_{name}_{searched}_{suffix} ON {name} '
+                            f'USING gin ('
+                            f'{expression.format(column=searched)})'))
+        except SQLAlchemyError as error:
+            warnings.warn(f'Search index not created: {error}')
+
+    elif engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            for name, searched in SEARCH_COLUMNS.items():
+                for suffix, options in SQLITE_INDEXES:
+                    fts = f'{name}_{suffix}'
+                    if engine.dialect.has_table(connection, fts):
+                        continue
+                    connection.execute(text(
+                        f'CREATE VIRTUAL TABLE {fts} USING '
+                        f'fts5({searched}, {options})'))
+                    connection.execute(text(
+                        f'INSERT INTO {fts} (rowid, {searched}) '
+                        f'SELECT id, {searched} FROM {name}'))
+
+
+@after_flush
+def sync_search_index(session, changes):
+    """Applies inserts, renames and deletes to the SQLite FTS5 tables.
+
+    Old entries are deleted and new ones inserted with one executemany per
+    FTS table, so a bulk insert costs a few statements.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        return
+
+    deletes = {}
+    inserts = {}
+    for change in changes:
+        searched = SEARCH_COLUMNS.get(change.table)
+        if searched is None:
+            continue
+        if change.action == 'update' and searched not in change.old:
+            continue
+
+        if change.action != 'insert':
+            deletes.setdefault(change.table, []).append(
+                {'id': change.row['id']})
+        if change.action != 'delete':
+            inserts.setdefault(change.table, []).append(
+                {'id': change.row['id'], 'value': change.row[searched]})
+
+    for name, searched in SEARCH_COLUMNS.items():
+        for suffix, _ in SQLITE_INDEXES:
+            fts = f'{name}_{suffix}'
+            if name in deletes:
+                session.execute(
+                    text(f'DELETE FROM {fts} WHERE rowid = :id'),
+                    deletes[name])
+            if name in inserts:
+                session.execute(
+                    text(f'INSERT INTO {fts} (rowid, {searched}) '
+                         f'VALUES (:id, :value)'),
+                    inserts[name])
+
+
+def escape_like(value):
+    """Escapes the LIKE wildcards in a search term."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+
+
+def match_fts(query, model, suffix, phrase):
+    """Joins a query to an FTS5 table and orders it by the match rank."""
+    fts = table(f'{model.__tablename__}_{suffix}',
+                column('rowid'), column('rank'))
+
+    return query.join(fts, fts.c.rowid == model.id).filter(
+        literal_column(fts.name).op('MATCH')(phrase)).order_by(
+        fts.c.rank, model.id)
+
+
+def search(model, q, fields, limit, offset):
+    """Finds the rows whose name or title best matches a search term.
+
+    Terms of at least MIN_SUBSTRING_LENGTH characters match anywhere in
+    the name or title, ranked by trigram similarity on PostgreSQL and
+    BM25 on SQLite. Shorter terms match the start of any word.
+
+    Args:
+        model: The Movie or Actor class.
+        q: The search term.
+        fields: JSON keys from get_fields_args.
+        limit: The maximum number of rows to return.
+        offset: The number of best matches to skip.
+
+    Returns:
+        The matching rows from project, best match first.
+    """
+    searched = getattr(model, SEARCH_COLUMNS[model.__tablename__])
+    query = project(model.query, model, fields, 'id')
+    dialect = db.session.get_bind().dialect.name
+    substring = len(q) >= MIN_SUBSTRING_LENGTH
+
+    if dialect == 'postgresql' and substring:
+        # The ILIKE catches exact substrings and word similarity catches
+        # close matches, and both are served by the trigram index
+        query = query.filter(or_(
+            searched.ilike('%' + escape_like(q) + '%', escape='\\'),
+            literal(q).op('<%')(searched))).order_by(
+            func.word_similarity(q, searched).desc(), model.id)
+
+    elif dialect == 'postgresql':
+        words = func.to_tsvector('simple', searched)
+        prefix = "'" + q.replace('\\', '\\\\').replace("'", "''") + "':*"
+        query = query.filter(words.op('@@')(
+            func.to_tsquery('simple', prefix))).order_by(
+            func.ts_rank(words, func.to_tsquery('simple', prefix)).desc(),
+            model.id)
+
+    elif dialect == 'sqlite' and substring and SQLITE_TRIGRAM:
+        query = match_fts(query, model, 'trigrams',
+                          '"' + q.replace('"', '""') + '"')
+
+    elif dialect == 'sqlite':
+        query = match_fts(query, model, 'words',
+                          '"' + q.replace('"', '""') + '" *')
+
+    else:
+        query = query.filter(searched.ilike(
+            '%' + escape_like(q) + '%', escape='\\')).order_by(
+            searched, model.id)
+
+    return query.limit(limit).offset(offset).all()
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import Counter
+from datetime import date
+from flask import current_app
+from sqlalchemy import extract, func
+
+from models import db, after_commit, parse_date, movie_actors, Actor, \
+    Movie
+
+# The rollups for this process, computed on first use
+_stats = None
+_computed_at = None
+_lock = threading.Lock()
+
+
+def get_year(value):
+    """Returns the year of a date or of an ISO date string."""
+    if isinstance(value, date):
+        return value.year
+    return parse_date(value).year
+
+
+def count(counter, key, delta):
+    """Adds delta to a Counter and drops the key once it reaches zero."""
+    counter[key] += delta
+    if counter[key] == 0:
+        del counter[key]
+
+
+class Stats(object):
+    """Rollups of the Actor and Movie tables.
+
+    Attributes:
+        age_bucket: The number of years in each bucket of ages.
+        genders: Actors keyed by gender.
+        ages: Actors keyed by the first age of their bucket.
+        years: Movies keyed by release year.
+        cast_sizes: The number of Actors keyed by Movie ID.
+        casts: Movies keyed by the number of Actors.
+        computed_at: The time.monotonic() before the rollups were read, so
+                     Changes committed earlier are already counted.
+    """
+
+    def __init__(self, age_bucket):
+        self.age_bucket = age_bucket
+        self.computed_at = time.monotonic()
+        self.genders = Counter()
+        self.ages = Counter()
+        self.years = Counter()
+        self.cast_sizes = {}
+        self.casts = Counter()
+
+    @classmethod
+    def compute(cls, age_bucket):
+        """Computes the rollups with GROUP BY queries."""
+        stats = cls(age_bucket)
+        session = db.session
+
+        for gender, total in session.query(
+                Actor.gender, func.count(Actor.id)).group_by(Actor.gender):
+            stats.genders[gender] = total
+
+        bucket = (Actor.age / age_bucket) * age_bucket
+        for age, total in session.query(
+                bucket, func.count(Actor.id)).group_by(bucket):
+            stats.ages[age] = total
+
+        year = extract('year', Movie.release_date)
+        for release_year, total in session.query(
+                year, func.count(Movie.id)).group_by(year):
+            stats.years[int(release_year)] = total
+
+        for movie_id, size in session.query(
+                Movie.id, func.count(movie_actors.c.actor_id)).outerjoin(
+                movie_actors).group_by(Movie.id):
+            stats.cast_sizes[movie_id] = size
+        stats.casts = Counter(stats.cast_sizes.values())
+
+        return stats
+
+    def __eq__(self, other):
+        return (self.genders, self.ages, self.years, self.cast_sizes) == (
+            other.genders, other.ages, other.years, other.cast_sizes)
+
+    def apply(self, change):
+        """Updates the rollups with a committed Change."""
+        row = change.row
+        delta = -1 if change.action == 'delete' else 1
+
+        if change.table == 'actor':
+            old = dict(row, **change.old)
+            if change.action == 'update':
+                self.add_actor(old, -1)
+            self.add_actor(row, delta)
+
+        elif change.table == 'movie':
+            if change.action == 'update' and 'release_date' in change.old:
+                count(self.years, get_year(change.old['release_date']), -1)
+                count(self.years, get_year(row['release_date']), 1)
+            elif change.action == 'insert':
+                count(self.years, get_year(row['release_date']), 1)
+                self.cast_sizes[row['id']] = 0
+                count(self.casts, 0, 1)
+            elif change.action == 'delete':
+                count(self.years, get_year(row['release_date']), -1)
+                # Unknown if another process inserted it after computing
+                size = self.cast_sizes.pop(row['id'], None)
+                if size is not None:
+                    count(self.casts, size, -1)
+
+        elif change.table == 'movie_actors':
+            # The links of a deleted Movie are already counted out
+            size = self.cast_sizes.get(row['movie_id'])
+            if size is not None:
+                count(self.casts, size, -1)
+                count(self.casts, size + delta, 1)
+                self.cast_sizes[row['movie_id']] = size + delta
+
+    def add_actor(self, row, delta):
+        """Counts an Actor's gender and age bucket delta times."""
+        count(self.genders, row['gender'], delta)
+        bucket = row['age'] // self.age_bucket * self.age_bucket
+        count(self.ages, bucket, delta)
+
+    def get_data(self):
+        """Returns a dictionary representation of the rollups."""
+        return {
+            'actorsByGender': {
+                gender or 'unknown': total
+                for gender, total in self.genders.items()},
+            'actorsByAge': [{
+                'minAge': age,
+                'maxAge': age + self.age_bucket - 1,
+                'actors': self.ages[age]
+            } for age in sorted(self.ages)],
+            'moviesByYear': [{
+                'year': year,
+                'movies': self.years[year]
+            } for year in sorted(self.years)],
+            'moviesByCastSize': [{
+                'actors': size,
+                'movies': self.casts[size]
+            } for size in sorted(self.casts)],
+            'totalActors': sum(self.genders.values()),
+            'totalMovies': len(self.cast_sizes)
+        }
+
+
+def get_stats(verify=False):
+    """Returns the rollups as a dictionary.
+
+    The rollups are computed on first use and after STATS_MAX_AGE seconds
+    to pick up writes from other processes. Writes by this process are
+    applied as they are committed.
+
+    Args:
+        verify: Whether to recompute the rollups and compare them with
+                the incrementally maintained ones.
+
+    Returns:
+        The dictionary from Stats.get_data, with 'consistent' set to
+        whether the rollups matched when verify is set. The recomputed
+        rollups are returned and kept either way.
+    """
+    global _stats, _computed_at
+
+    with _lock:
+        age_bucket = current_app.config['STATS_AGE_BUCKET']
+        max_age = current_app.config['STATS_MAX_AGE']
+        stale = _computed_at is None or \
+            time.monotonic() - _computed_at > max_age
+        if stale or verify:
+            stats = Stats.compute(age_bucket)
+            consistent = _stats is None or stats == _stats
+            _stats = stats
+            _computed_at = time.monotonic()
+
+        data = _stats.get_data()
+        if verify:
+            data['consistent'] = consistent
+        return data
+
+
+@after_commit
+def update_stats(changes):
+    """Applies committed Changes to the rollups.
+
+    The rollups are checked under the lock, so a commit made while they
+    are first computed waits for them. Changes committed before the
+    rollups were read are already counted in them and are skipped.
+    """
+    with _lock:
+        if _stats is None:
+            return
+
+        # Links of a new Movie may come before the Movie itself
+        for change in sorted(
+                changes, key=lambda change: change.table == 'movie_actors'):
+            if change.committed_at is None or \
+                    change.committed_at >= _stats.computed_at:
+                _stats.apply(change)
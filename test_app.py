@@ -1,10 +1,108 @@
 import unittest
+from contextlib import contextmanager
 from faker import Faker
 import random
 import json
+from base64 import urlsafe_b64encode
+import gzip
+import threading
+import time
+from datetime import datetime, timedelta
+import os
+import runpy
+import rsa
+from jose import jwk, jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+import auth
+import app as app_module
 from app import create_app
-from models import db, setup_db, Actor, Movie
+from auth import AuthError, JWKSCache, TokenCache, check_permissions, \
+    get_payload, verify_decode_jwt
+from models import db, setup_db, after_commit, dispose_engines, Actor, \
+    Movie, Change
+import models
+import stats
+from graph import CastingGraph, Adjacency
+from cache import MemoryStore, ResponseCache, get_cache
+from schema_utils import get_schemas
+import compression
+from db_pool import InstrumentedQueuePool, instrument_pool, \
+    get_engine_options, get_pool_metrics
+from db_routing import setup_replicas
+from config import ProductionConfig
+from unit_of_work import savepoint, commit_immediately
+
+
+@contextmanager
+def count_statements():
+    """Collects the SQL statements executed within the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(
+            db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def create_signing_key():
+    """Creates an RSA key for signing test tokens.
+
+    Returns:
+        A tuple of the public key as a JWK without a kid, and a function
+        signing claims with a kid in the header.
+    """
+    public_key, private_key = rsa.newkeys(512)
+    key = jwk.construct(public_key.save_pkcs1(), 'RS256').to_dict()
+    key['use'] = 'sig'
+
+    def sign(kid, claims):
+        return jwt.encode(claims, private_key.save_pkcs1().decode(),
+                          algorithm='RS256', headers={'kid': kid})
+
+    return key, sign
+
+
+def create_claims(permissions, subject=0, expires_in=60):
+    """Returns the claims of a valid Auth0 access token."""
+    return {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|%d' % subject,
+        'exp': int(time.time()) + expires_in,
+        'permissions': permissions
+    }
+
+
+class SharedStore(object):
+    """A stand-in for a Redis client shared by several processes."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = str(value).encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def incr(self, key):
+        value = int(self.values.get(key, 0)) + 1
+        self.values[key] = str(value).encode()
+        return value
 
 
 class CastingAgencyTestCase(unittest.TestCase):
@@ -36,6 +134,12 @@ class CastingAgencyTestCase(unittest.TestCase):
         """Not used since everything is covered in the tearDownClass method."""
         pass
 
+    def disable_response_cache(self):
+        """Makes GET endpoints run their queries for the rest of a test."""
+        self.app.config['RESPONSE_CACHE_ENABLED'] = False
+        self.addCleanup(
+            self.app.config.__setitem__, 'RESPONSE_CACHE_ENABLED', True)
+
     def create_test_data(self):
         """Creates new data for the test DB using the Faker library."""
         fake = Faker(['en_US', 'ja_JP', 'el_GR', 'de_DE'])
@@ -90,9 +194,280 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(len(res_body['actors']), 10)
         self.assertEqual(res_body['totalActors'], len(Actor.query.all()))
 
+    def test_get_actor_costars(self):
+        """Verifies the /api/actors/<actor_id>/costars endpoint for GET."""
+        actors = random.sample(Actor.query.all(), 3)
+        movies = random.sample(Movie.query.all(), 3)
+        actors[0].movies.extend(
+            movie for movie in movies if movie not in actors[0].movies)
+        actors[1].movies.extend(
+            movie for movie in movies[:2] if movie not in actors[1].movies)
+        actors[2].movies.extend(
+            movie for movie in movies[:1] if movie not in actors[2].movies)
+        db.session.commit()
+
+        actor = actors[0]
+        actor_id = actor.id
+        expected = {}
+        for movie in actor.movies:
+            for costar in movie.actors:
+                if costar.id != actor_id:
+                    expected[costar.id] = expected.get(costar.id, 0) + 1
+
+        res = self.client().get(
+            '/api/actors/%d/costars?per_page=100' % actor_id)
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['totalCostars'], len(expected))
+        self.assertEqual(
+            {costar['id']: costar['sharedMovies']
+             for costar in res_body['costars']}, expected)
+        shared = [costar['sharedMovies'] for costar in res_body['costars']]
+        self.assertEqual(shared, sorted(shared, reverse=True))
+
+        res = self.client().get('/api/actors/9000/costars')
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_costar_path(self):
+        """Verifies /api/graph/path follows links as they change."""
+        actors = [Actor('Path Actor %d' % i, 40, 'F') for i in range(3)]
+        movies = [Movie('Path Movie %d' % i, '2000-01-01') for i in range(2)]
+        movies[0].actors = actors[:2]
+        movies[1].actors = actors[1:]
+        db.session.add_all(actors + movies)
+        db.session.commit()
+        actor_ids = [actor.id for actor in actors]
+        movie_ids = [movie.id for movie in movies]
+
+        res = self.client().get('/api/graph/path?from=%d&to=%d' % (
+            actor_ids[0], actor_ids[2]))
+        self.assertEqual(res.status_code, 200)
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['degrees'], 2)
+        self.assertEqual([actor['id'] for actor in res_body['actors']],
+                         actor_ids)
+        self.assertEqual([movie['id'] for movie in res_body['movies']],
+                         movie_ids)
+
+        self.client().patch('/api/movies/%d' % movie_ids[1],
+                            json={'removeActors': [actor_ids[2]]})
+        res = self.client().get('/api/graph/path?from=%d&to=%d' % (
+            actor_ids[0], actor_ids[2]))
+        res_body = json.loads(res.data)
+        self.assertIsNone(res_body['degrees'])
+        self.assertEqual(res_body['actors'], [])
+
+        res = self.client().get('/api/graph/path?from=%d' % actor_ids[0])
+        self.assertEqual(res.status_code, 400)
+
+    def test_casting_graph_compact(self):
+        """Verifies the graph keeps its links when changes are compacted."""
+        graph = CastingGraph(Adjacency([(1, 10), (1, 11), (2, 10)]),
+                             Adjacency([(10, 1), (10, 2), (11, 1)]), 0)
+        graph.link(3, 11)
+        graph.unlink(2, 10)
+        graph.link(2, 10)
+        graph.unlink(1, 10)
+        self.assertEqual(graph.get_costars(3), [(1, 1)])
+
+        graph.compact()
+        self.assertEqual(graph.actors.changes, 0)
+        self.assertEqual(list(graph.movies.neighbours(10)), [2])
+        self.assertEqual(list(graph.movies.neighbours(11)), [1, 3])
+        self.assertEqual(graph.find_path(2, 3), None)
+        self.assertEqual(graph.find_path(1, 3), ([1, 3], [11]))
+
+    def test_get_stats(self):
+        """Verifies /api/stats stays consistent with the DB across writes."""
+        db.session.commit()
+        res = self.client().get('/api/stats')
+        self.assertEqual(res.status_code, 200)
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['totalActors'], Actor.query.count())
+        self.assertEqual(
+            sum(year['movies'] for year in res_body['moviesByYear']),
+            Movie.query.count())
+
+        actor_id = self.client().post(
+            '/api/actors', json=self.actor_request).get_json()['created']
+        movie_id = self.client().post(
+            '/api/movies', json=self.movie_request).get_json()['created']
+        self.client().patch('/api/actors/%d' % actor_id,
+                            json={'age': 20, 'addMovies': [movie_id]})
+        self.client().patch('/api/movies/%d' % movie_id,
+                            json={'releaseDate': '1950-6-1'})
+        self.client().patch('/api/actors/%d' % actor_id,
+                            json={'removeMovies': [movie_id]})
+        self.client().delete('/api/actors/%d' % actor_id)
+
+        res = self.client().get('/api/stats?verify=true')
+        self.assertEqual(res.status_code, 200)
+        res_body = json.loads(res.data)
+        self.assertTrue(res_body['consistent'])
+        years = [year['year'] for year in res_body['moviesByYear']]
+        self.assertIn(1950, years)
+
+        res = self.client().get('/api/stats?verify=yes')
+        self.assertEqual(res.status_code, 400)
+
+        committed = []
+        listeners = [after_commit(lambda changes: 1 / 0),
+                     after_commit(committed.append)]
+        for listener in listeners:
+            self.addCleanup(models._commit_listeners.remove, listener)
+        with self.assertLogs('models', 'ERROR'):
+            res = self.client().delete('/api/movies/%d' % movie_id)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(committed), 1)
+
+        # A Change the rollups already count, and the delete of a Movie
+        # they never saw, e.g. one inserted by another process
+        movie = {'id': 0, 'title': 'Elsewhere',
+                 'release_date': datetime(2000, 1, 1).date()}
+        with self.app.app_context():
+            data = stats.get_stats()
+            counted = Change('movie', 'insert', dict(movie))
+            counted.committed_at = stats._stats.computed_at - 1
+            stats.update_stats([counted])
+            self.assertEqual(stats.get_stats(), data)
+            stats.update_stats([Change('movie', 'delete', movie)])
+            self.assertEqual(stats.get_stats()['totalMovies'],
+                             data['totalMovies'])
+
+    def test_response_cache(self):
+        """Verifies cached GET responses are invalidated only by writes
+        to the rows they contain."""
+        actor, other_actor = random.sample(Actor.query.all(), 2)
+        movie = random.choice(Movie.query.all())
+        if movie not in actor.movies:
+            actor.movies.append(movie)
+        db.session.commit()
+        actor_id, other_actor_id, movie_id = \
+            actor.id, other_actor.id, movie.id
+        url = '/api/actors/%d' % actor_id
+
+        self.client().get(url)
+        res = self.client().get(url)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+
+        self.client().patch('/api/actors/%d' % other_actor_id,
+                            json={'age': 33})
+        res = self.client().get(url)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+
+        self.client().patch('/api/movies/%d' % movie_id,
+                            json={'title': 'Cache Buster'})
+        res = self.client().get(url)
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        titles = [m['title'] for m in json.loads(res.data)['actor']['movies']]
+        self.assertIn('Cache Buster', titles)
+
+        res = self.client().get('/api/metrics')
+        metrics = json.loads(res.data)['responseCache']
+        self.assertGreaterEqual(metrics['hits'], 2)
+        self.assertGreaterEqual(metrics['evictions'], 1)
+
+    def test_response_cache_shared_store(self):
+        """Verifies caches sharing a store see each other's invalidations."""
+        store = SharedStore()
+        first, second = ResponseCache(store), ResponseCache(store)
+
+        first.set('key', '{}', first.get_versions(['actor:1', 'movie']))
+        self.assertEqual(second.get('key'), '{}')
+
+        second.invalidate(['actor:2'])
+        self.assertEqual(first.get('key'), '{}')
+
+        second.invalidate(['actor:1'])
+        self.assertIsNone(first.get('key'))
+        self.assertEqual(first.get_metrics(),
+                         {'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_response_cache_counters(self):
+        """Verifies tag counters are bounded without repeating versions."""
+        cache = ResponseCache(MemoryStore(max_entries=8, max_counters=3))
+        cache.set('key', '{}', cache.get_versions(['actor:1']))
+        cache.invalidate(['actor:1'])
+        versions = cache.get_versions(['actor:1'])
+        for i in range(2, 5):
+            cache.invalidate(['actor:%d' % i])
+        self.assertLessEqual(len(cache.store._counters), 3)
+
+        cache.set('key', '{}', versions)
+        self.assertIsNone(cache.get('key'))
+        cache.invalidate(['actor:1'])
+        self.assertGreater(cache.get_versions(['actor:1'])['actor:1'],
+                           versions['actor:1'])
+
+    def test_conditional_get_movies(self):
+        """Verifies /api/movies answers If-None-Match and If-Modified-Since
+        with 304 until a Movie is written."""
+        # Last-Modified is only sent once the second of the last write
+        # is over
+        db.session.execute(models.table_versions.update().values(
+            updated_at=datetime.utcnow() - timedelta(seconds=2)))
+        db.session.commit()
+        res = self.client().get('/api/movies')
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers['ETag']
+        last_modified = res.headers['Last-Modified']
+
+        with count_statements() as statements:
+            res = self.client().get('/api/movies',
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(res.headers['ETag'], etag)
+
+        res = self.client().get('/api/movies',
+                                headers={'If-Modified-Since': last_modified})
+        self.assertEqual(res.status_code, 304)
+
+        self.client().post('/api/movies', json=self.movie_request)
+        res = self.client().get('/api/movies',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+        res = self.client().get('/api/movies',
+                                headers={'If-Modified-Since': last_modified})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Last-Modified', res.headers)
+
+    def test_conditional_get_actor_detail(self):
+        """Verifies the ETag of /api/actors/<actor_id> changes with the
+        Actor and its Movies but not with other Actors."""
+        actor, other_actor = random.sample(Actor.query.all(), 2)
+        actor_id, other_actor_id = actor.id, other_actor.id
+        new_age = actor.age % 80 + 20
+        movie_id = random.choice(
+            [movie for movie in Movie.query.all()
+             if movie not in actor.movies]).id
+        url = '/api/actors/%d' % actor_id
+
+        etag = self.client().get(url).headers['ETag']
+        self.client().patch('/api/actors/%d' % other_actor_id,
+                            json={'age': 44})
+        res = self.client().get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        for update in [{'age': new_age}, {'addMovies': [movie_id]}]:
+            self.client().patch(url, json=update)
+            res = self.client().get(url, headers={'If-None-Match': etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], etag)
+            etag = res.headers['ETag']
+
+        res = self.client().get('/api/actors/9000',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 404)
+
     def test_get_actor_detail(self):
         """Verifies the /api/actors/<actor_id> endpoint for GET."""
         actor = random.choice(Actor.query.all())
+        movies = sorted([movie.get_data() for movie in actor.movies],
+                        key=lambda movie: movie['id'])
 
         res = self.client().get('/api/actors/' + str(actor.id))
         self.assertEqual(res.status_code, 200)
@@ -101,7 +476,123 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res_body['actor']['name'], actor.name)
         self.assertEqual(res_body['actor']['age'], actor.age)
         self.assertEqual(res_body['actor']['gender'], actor.gender)
-        self.assertEqual(res_body['actor']['movies'], actor.movies)
+        self.assertEqual(res_body['actor']['movies'], movies)
+
+    def test_get_actor_detail_statements(self):
+        """Verifies /api/actors/<actor_id> runs a fixed number of queries."""
+        self.disable_response_cache()
+        actor = random.choice(Actor.query.all())
+        actor.movies = Movie.query.all()
+        actor.update()
+        actor_id = actor.id
+
+        with count_statements() as statements:
+            res = self.client().get('/api/actors/' + str(actor_id))
+        self.assertEqual(res.status_code, 200)
+        # The ETag versions, the Actor and its Movies
+        self.assertEqual(len(statements), 3)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(len(res_body['actor']['movies']),
+                         len(Movie.query.all()))
+
+    def test_get_actors_per_page(self):
+        """Verifies the /api/actors endpoint for GET with per_page."""
+        res = self.client().get('/api/actors?page=2&per_page=5')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        expected_ids = [actor.id for actor in
+                        Actor.query.order_by(Actor.id).limit(5).offset(5)]
+        self.assertEqual(
+            [actor['id'] for actor in res_body['actors']], expected_ids)
+
+        res = self.client().get('/api/actors?page=0&per_page=5')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['id'] for actor in
+                          json.loads(res.data)['actors']],
+                         [actor.id for actor in
+                          Actor.query.order_by(Actor.id).limit(5)])
+
+    def test_get_actors_fields(self):
+        """Verifies the /api/actors endpoint for GET with fields."""
+        res = self.client().get('/api/actors?fields=id,name')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        for actor in res_body['actors']:
+            self.assertEqual(set(actor), {'id', 'name'})
+
+        res = self.client().get('/api/actors?fields=id,salary')
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_filters(self):
+        """Verifies the /api/actors endpoint for GET with filters."""
+        res = self.client().get(
+            '/api/actors?gender=F&age_min=30&age_max=60&sort=-age')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        expected = Actor.query.filter(
+            Actor.gender == 'F', Actor.age >= 30, Actor.age <= 60)
+        self.assertEqual(res_body['totalActors'], expected.count())
+        ages = [actor['age'] for actor in res_body['actors']]
+        self.assertEqual(ages, sorted(ages, reverse=True))
+        for actor in res_body['actors']:
+            self.assertEqual(actor['gender'], 'F')
+            self.assertTrue(30 <= actor['age'] <= 60)
+
+        res = self.client().get('/api/actors?gender=X')
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_ids(self):
+        """Verifies the /api/actors endpoint for GET with IDs."""
+        self.disable_response_cache()
+        actor_ids = [actor.id for actor in Actor.query.all()][:3][::-1]
+        ids = ','.join(str(id) for id in [actor_ids[0], 9000] + actor_ids)
+
+        with count_statements() as statements:
+            res = self.client().get('/api/actors?ids=' + ids)
+        self.assertEqual(res.status_code, 200)
+        # The ETag versions and the Actors
+        self.assertEqual(len(statements), 2)
+
+        res_body = json.loads(res.data)
+        self.assertEqual([actor['id'] for actor in res_body['actors']],
+                         [actor_ids[0]] + actor_ids)
+        self.assertEqual(res_body['notFound'], [9000])
+
+        res = self.client().get('/api/movies?ids=9000&fields=title')
+        self.assertEqual(res.status_code, 200)
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['movies'], [])
+        self.assertEqual(res_body['notFound'], [9000])
+
+    def test_get_actors_ids_400(self):
+        """Verifies /api/actors rejects invalid or too many IDs."""
+        res = self.client().get('/api/actors?ids=1,a')
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().get(
+            '/api/actors?ids=' + ','.join(str(id) for id in range(101)))
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_cursor(self):
+        """Verifies the /api/actors endpoint for GET with a cursor."""
+        actors = []
+        next_cursor = ''
+        while next_cursor is not None:
+            res = self.client().get(
+                '/api/actors?sort=-name&per_page=7&cursor=' + next_cursor)
+            self.assertEqual(res.status_code, 200)
+
+            res_body = json.loads(res.data)
+            actors.extend(res_body['actors'])
+            next_cursor = res_body['next']
+
+        expected_ids = [actor.id for actor in Actor.query.order_by(
+            Actor.name.desc(), Actor.id.desc())]
+        self.assertEqual([actor['id'] for actor in actors], expected_ids)
 
     def test_get_movies(self):
         """Verifies the /api/movies endpoint for GET."""
@@ -112,9 +603,26 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(len(res_body['movies']), 10)
         self.assertEqual(res_body['totalMovies'], len(Movie.query.all()))
 
+    def test_get_movies_filters(self):
+        """Verifies the /api/movies endpoint for GET with date filters."""
+        res = self.client().get(
+            '/api/movies?released_after=2000-01-01&sort=-release_date')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        dates = [movie['releaseDate'] for movie in res_body['movies']]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        for release_date in dates:
+            self.assertGreaterEqual(release_date, '2000-01-01')
+
+        res = self.client().get('/api/movies?released_after=yesterday')
+        self.assertEqual(res.status_code, 400)
+
     def test_get_movie_detail(self):
         """Verifies the /api/movies/<movie_id> endpoint for GET."""
         movie = random.choice(Movie.query.all())
+        actors = sorted([actor.get_data() for actor in movie.actors],
+                        key=lambda actor: actor['id'])
 
         res = self.client().get('/api/movies/' + str(movie.id))
         self.assertEqual(res.status_code, 200)
@@ -124,7 +632,79 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(
             res_body['movie']['releaseDate'], str(
                 movie.release_date))
-        self.assertEqual(res_body['movie']['actors'], movie.actors)
+        self.assertEqual(res_body['movie']['actors'], actors)
+
+    def test_get_movie_detail_statements(self):
+        """Verifies /api/movies/<movie_id> runs a fixed number of queries."""
+        self.disable_response_cache()
+        movie_id = random.choice(Movie.query.all()).id
+
+        with count_statements() as statements:
+            res = self.client().get('/api/movies/' + str(movie_id))
+        self.assertEqual(res.status_code, 200)
+        # The ETag versions, the Movie and its Actors
+        self.assertEqual(len(statements), 3)
+
+        with count_statements() as statements:
+            res = self.client().get(
+                '/api/movies/' + str(movie_id) + '?fields=id,title')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 2)
+
+    def test_get_movie_detail_fields(self):
+        """Verifies the /api/movies/<movie_id> endpoint for GET with fields."""
+        movie = random.choice(Movie.query.all())
+
+        res = self.client().get(
+            '/api/movies/' + str(movie.id) + '?fields=id,title')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(
+            res_body['movie'], {'id': movie.id, 'title': movie.title})
+
+    def test_export_actors(self):
+        """Verifies the /api/actors/export endpoint for GET."""
+        res = self.client().get('/api/actors/export?include=movieIds')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+
+        actors = [json.loads(line) for line in res.data.splitlines()]
+        self.assertEqual([actor['id'] for actor in actors],
+                         [actor.id for actor in
+                          Actor.query.order_by(Actor.id)])
+        for actor in actors:
+            self.assertEqual(actor['movieIds'], sorted(
+                movie.id for movie in Actor.query.get(actor['id']).movies))
+
+    def test_search(self):
+        """Verifies the /api/search endpoint for GET."""
+        actor = random.choice(Actor.query.all())
+        q = actor.name.split()[-1]
+
+        res = self.client().get('/api/search', query_string={'q': q})
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        self.assertIn(actor.id, [match['id'] for match in
+                                 res_body['actors']])
+        for match in res_body['actors']:
+            self.assertIn(q.lower(), match['name'].lower())
+
+    def test_search_renamed_actor(self):
+        """Verifies the /api/search endpoint finds updated names."""
+        actor = random.choice(Actor.query.all())
+        actor_id = actor.id
+        actor.name = 'Zyxwvuts Searchable'
+        actor.update()
+
+        res = self.client().get(
+            '/api/search?type=actors&fields=id&q=zyxwvut')
+        self.assertEqual(res.status_code, 200)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['actors'], [{'id': actor_id}])
+        self.assertNotIn('movies', res_body)
 
     def test_create_actor(self):
         """Verifies the /api/actors endpoint for POST."""
@@ -140,6 +720,60 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(self.actor_request['age'], new_actor.age)
         self.assertEqual(self.actor_request['gender'], new_actor.gender)
 
+    def test_create_actors_bulk(self):
+        """Verifies the /api/actors/bulk endpoint for POST."""
+        items = [dict(self.actor_request, name='Actor %d' % i)
+                 for i in range(3)]
+        res = self.client().post('/api/actors/bulk', json=items)
+        self.assertEqual(res.status_code, 201)
+
+        res_body = json.loads(res.data)
+        self.assertTrue(res_body['success'])
+        self.assertEqual(res_body['created'], 3)
+        ids = [result['id'] for result in res_body['results']]
+        names = {actor.id: actor.name
+                 for actor in Actor.query.filter(Actor.id.in_(ids))}
+        self.assertEqual([names[id] for id in ids],
+                         [item['name'] for item in items])
+
+        res = self.client().get('/api/search?q=Actor 2&type=actors')
+        res_body = json.loads(res.data)
+        self.assertIn(ids[2], [actor['id'] for actor in res_body['actors']])
+
+    def test_create_movies_bulk_modes(self):
+        """Verifies atomic and partial modes of /api/movies/bulk."""
+        items = [self.movie_request, {'title': 'No release date'}]
+        total_movies = Movie.query.count()
+
+        res = self.client().post('/api/movies/bulk', json=items)
+        self.assertEqual(res.status_code, 400)
+        res_body = json.loads(res.data)
+        self.assertFalse(res_body['success'])
+        self.assertEqual(res_body['created'], 0)
+        self.assertEqual(res_body['results'][0], {})
+        self.assertIn('error', res_body['results'][1])
+        self.assertEqual(Movie.query.count(), total_movies)
+
+        res = self.client().post('/api/movies/bulk?mode=partial', json=items)
+        self.assertEqual(res.status_code, 201)
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['created'], 1)
+        self.assertIn('id', res_body['results'][0])
+        self.assertIn('error', res_body['results'][1])
+        self.assertEqual(Movie.query.count(), total_movies + 1)
+
+        res = self.client().post('/api/movies/bulk', json=self.movie_request)
+        self.assertEqual(res.status_code, 400)
+
+        items = [self.movie_request,
+                 {'title': 'Unpadded', 'releaseDate': '2020-1-5'}]
+        res = self.client().post('/api/movies/bulk', json=items)
+        self.assertEqual(res.status_code, 201)
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['created'], 2)
+        movie = Movie.query.get(res_body['results'][1]['id'])
+        self.assertEqual(str(movie.release_date), '2020-01-05')
+
     def test_create_movie(self):
         """Verifies the /api/movies endpoint for POST."""
         res = self.client().post('/api/movies', json=self.movie_request)
@@ -170,6 +804,74 @@ class CastingAgencyTestCase(unittest.TestCase):
         movie = Movie.query.get(movie_id)
         self.assertTrue(movie in updated_actor.movies)
 
+    def test_update_actor_statements(self):
+        """Verifies PATCH /api/actors/<actor_id> runs a fixed number of
+        queries regardless of the number of Movies."""
+        actor = random.choice(Actor.query.all())
+        actor.movies = Movie.query.all()
+        actor.update()
+        actor_id = actor.id
+
+        with count_statements() as statements:
+            res = self.client().patch(
+                '/api/actors/' + str(actor_id), json={'age': 50})
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(statements), 5)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['actor']['age'], 50)
+        self.assertEqual(len(res_body['actor']['movies']),
+                         len(Movie.query.all()))
+
+    def test_update_movie_add_remove_actors(self):
+        """Verifies PATCH /api/movies/<movie_id> links and unlinks Actors
+        without loading or rewriting the rest of the cast."""
+        movie = random.choice(Movie.query.all())
+        actors = Actor.query.order_by(Actor.id).all()
+        movie.actors = actors[1:]
+        movie.update()
+        movie_id = movie.id
+        actor_ids = [actor.id for actor in actors]
+
+        with count_statements() as statements:
+            res = self.client().patch('/api/movies/' + str(movie_id), json={
+                'addActors': [actor_ids[0], actor_ids[1], 9000],
+                'removeActors': [actor_ids[2]]})
+        self.assertEqual(res.status_code, 200)
+        writes = [statement.split()[0] for statement in statements
+                  if statement.split()[0] in ('INSERT', 'DELETE')]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT'])
+        self.assertLessEqual(len(statements), 8)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['notFound'], [9000])
+        self.assertEqual(
+            sorted(actor['id'] for actor in res_body['movie']['actors']),
+            sorted(actor_ids[:2] + actor_ids[3:]))
+
+        res = self.client().patch('/api/movies/' + str(movie_id), json={
+            'actors': actor_ids, 'addActors': actor_ids})
+        self.assertEqual(res.status_code, 400)
+
+    def test_update_movie_not_found(self):
+        """Verifies PATCH /api/movies/<movie_id> reports unknown Actors
+        and resolves the Actors in a fixed number of queries."""
+        movie_id = random.choice(Movie.query.all()).id
+        actor_ids = [actor.id for actor in Actor.query.all()]
+
+        with count_statements() as statements:
+            res = self.client().patch(
+                '/api/movies/' + str(movie_id),
+                json={'actors': actor_ids + [9000, 9001]})
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(statements), 8)
+
+        res_body = json.loads(res.data)
+        self.assertEqual(res_body['notFound'], [9000, 9001])
+        self.assertEqual(
+            sorted(actor['id'] for actor in res_body['movie']['actors']),
+            sorted(actor_ids))
+
     def test_update_movie(self):
         """Verifies the /api/movies/<movie_id> endpoint for PATCH."""
         actor_id = random.choice(Actor.query.all()).id
@@ -209,6 +911,379 @@ class CastingAgencyTestCase(unittest.TestCase):
         for id in actor_ids:
             self.assertTrue(Actor.query.get(id))
 
+    def test_jwks_cache(self):
+        """Verifies the JWKS is fetched once and refreshed for new kids."""
+        key, sign = create_signing_key()
+        jwks = {'keys': [dict(key, kid='old')]}
+        cache = JWKSCache(lambda: jwks, min_refresh_interval=0)
+        claims = create_claims(['get:actors'])
+
+        original = auth.jwks_cache
+        auth.jwks_cache = cache
+        self.addCleanup(setattr, auth, 'jwks_cache', original)
+
+        for _ in range(3):
+            self.assertEqual(
+                verify_decode_jwt(sign('old', claims)), claims)
+        self.assertEqual(cache.fetches, 1)
+
+        # A rotated key is picked up by a forced refresh
+        jwks = {'keys': [dict(key, kid='new')]}
+        self.assertEqual(verify_decode_jwt(sign('new', claims)), claims)
+        self.assertEqual(cache.fetches, 2)
+
+        # Unknown kids cannot force more than one refresh per interval
+        cache.min_refresh_interval = 60
+        for _ in range(3):
+            with self.assertRaises(AuthError):
+                verify_decode_jwt(sign('unknown', claims))
+        self.assertEqual(cache.fetches, 2)
+
+        # Concurrent refreshes collapse into one fetch
+        cache.source = lambda: time.sleep(0.05) or jwks
+        threads = [threading.Thread(
+            target=cache.refresh, args=(cache._generation,))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.fetches, 3)
+
+    def test_token_cache(self):
+        """Verifies tokens are verified once until they expire or rotate."""
+        key, sign = create_signing_key()
+        jwks = {'keys': [dict(key, kid='old')]}
+        keys = JWKSCache(lambda: jwks, min_refresh_interval=0)
+        tokens = TokenCache(max_entries=2)
+        keys.listeners.append(tokens.invalidate)
+        for name, value in [('jwks_cache', keys), ('token_cache', tokens)]:
+            self.addCleanup(setattr, auth, name, getattr(auth, name))
+            setattr(auth, name, value)
+
+        token = sign('old', create_claims(['get:actors', 'get:movies']))
+        for _ in range(3):
+            payload, permissions = get_payload(token)
+            self.assertEqual(
+                permissions, frozenset(['get:actors', 'get:movies']))
+            check_permissions('get:movies', payload, permissions)
+        with self.assertRaises(AuthError):
+            check_permissions('delete:actors', payload, permissions)
+        self.assertEqual((tokens.hits, tokens.misses), (2, 1))
+
+        # Only max_entries tokens are kept, least recently used first out
+        others = [sign('old', create_claims([], i)) for i in range(2)]
+        for other in others:
+            get_payload(other)
+        self.assertIsNone(tokens.get(token))
+        self.assertIsNotNone(tokens.get(others[1]))
+
+        # Tokens are dropped when they expire
+        claims = create_claims([], expires_in=2)
+        expiring = sign('old', claims)
+        get_payload(expiring)
+        self.assertIsNotNone(tokens.get(expiring))
+        time.sleep(claims['exp'] - time.time())
+        self.assertIsNone(tokens.get(expiring))
+
+        # Tokens signed with a rotated key are verified again
+        get_payload(token)
+        jwks = {'keys': [dict(key, kid='new')]}
+        keys.refresh()
+        self.assertIsNone(tokens.get(token))
+        with self.assertRaises(AuthError):
+            get_payload(token)
+
+    def test_schema_fast_path(self):
+        """Verifies the fast paths only accept bodies jsonschema accepts."""
+        values = [None, True, 1, 1.0, -2, '', 'M', 'F', 'X', 'Actor',
+                  '2020-01-31', '2020-02-31', [], [1, 2], [1, 'a'], [True],
+                  {}]
+        names = ['name', 'age', 'gender', 'title', 'releaseDate', 'movies',
+                 'addMovies', 'removeMovies', 'actors', 'addActors', 'other']
+        rng = random.Random(0)
+        bodies = [None, [], 'actor'] + [
+            {rng.choice(names): rng.choice(values)
+             for _ in range(rng.randint(0, 4))} for _ in range(2000)] + [
+            {'name': 'Actor', 'age': 30, 'gender': 'F'},
+            {'title': 'Movie', 'releaseDate': '2020-01-31'}]
+
+        for name, schema in get_schemas().items():
+            self.assertIsNotNone(schema.fast_path, name)
+            accepted = 0
+            for body in bodies:
+                valid = schema.validator.is_valid(body)
+                if schema.fast_path(body):
+                    self.assertTrue(valid, (name, body))
+                    accepted += 1
+                elif valid:
+                    # 1.0 is an integer to jsonschema, but not to the fast
+                    # path, which leaves it to the full validator
+                    self.assertIn(1.0, body.values(), (name, body))
+            self.assertGreater(accepted, 0, name)
+
+    def test_json_provider(self):
+        """Verifies orjson writes the same bytes as the standard library."""
+        self.disable_response_cache()
+        self.addCleanup(setattr, self.app.json, 'fast', self.app.json.fast)
+        actor = random.choice(Actor.query.all())
+        movie = random.choice(Movie.query.all())
+        urls = ['/api/actors', '/api/movies?per_page=100',
+                '/api/movies?cursor=&sort=-release_date', '/api/stats',
+                '/api/actors/%d' % actor.id, '/api/movies/%d' % movie.id,
+                '/api/search?q=%s' % actor.name.split()[-1],
+                '/api/actors/%d/costars' % actor.id, '/api/actors/0']
+
+        for url in urls:
+            self.app.json.fast = True
+            fast = self.client().get(url)
+            self.app.json.fast = False
+            slow = self.client().get(url)
+            self.assertEqual(fast.data, slow.data, url)
+
+        self.app.json.fast = True
+        for data in [{'name': 'Zo\u00eb \u2028\U0001f3ac', 'age': 30},
+                     {'name': 'del\x7fchar'},
+                     {'big': 2 ** 70}, {1: 'non-string key'},
+                     ['a', None, True, 1.5]]:
+            for args in [{'indent': 2}, {'separators': (',', ':')}, {}]:
+                self.assertEqual(self.app.json.dumps(data, **args),
+                                 json.dumps(data, sort_keys=True, **args))
+
+        # Floats only differ in how the exponent is written
+        floats = [1e-07, 1e+16, 0.1]
+        compact = self.app.json.dumps(floats, separators=(',', ':'))
+        self.assertEqual(compact, '[1e-7,1e16,0.1]')
+        self.assertEqual(json.loads(compact), floats)
+
+    def test_compression(self):
+        """Verifies responses are compressed for clients accepting gzip."""
+        gzip_headers = {'Accept-Encoding': 'gzip, deflate'}
+        plain = self.client().get('/api/movies?per_page=100')
+        res = self.client().get('/api/movies?per_page=100',
+                                headers=gzip_headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertLess(len(res.data), len(plain.data))
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+        # The ETag differs by encoding and still matches If-None-Match
+        self.assertEqual(res.headers['ETag'],
+                         plain.headers['ETag'][:-1] + '-gzip"')
+        res = self.client().get(
+            '/api/movies?per_page=100', headers=dict(
+                gzip_headers, **{'If-None-Match': res.headers['ETag']}))
+        self.assertEqual(res.status_code, 304)
+
+        # Cached responses are only compressed once
+        calls = []
+        original = compression.compress
+        self.addCleanup(setattr, compression, 'compress', original)
+        compression.compress = lambda *args: calls.append(args) or \
+            original(*args)
+        for _ in range(2):
+            res = self.client().get('/api/actors?per_page=100',
+                                    headers=gzip_headers)
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(len(calls), 1)
+
+        # Streamed exports are compressed chunk by chunk
+        plain = self.client().get('/api/actors/export')
+        res = self.client().get('/api/actors/export', headers=gzip_headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+        # Small bodies and clients without gzip are left alone
+        for url, headers in [('/api/actors/0', gzip_headers),
+                             ('/api/movies?per_page=100',
+                              {'Accept-Encoding': 'identity'})]:
+            res = self.client().get(url, headers=headers)
+            self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_db_pool(self):
+        """Verifies the pool settings, metrics and the 503 on timeouts."""
+        config = dict(self.app.config, DB_POOL_FAIL_FAST_WAIT=0.1)
+        options = get_engine_options(config, 'postgres://localhost/test')
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_timeout'], 0.1)
+        self.assertEqual(get_engine_options(config, 'sqlite://'), {})
+
+        options.pop('pool_recycle')
+        engine = create_engine(
+            'sqlite://', connect_args={'check_same_thread': False},
+            **dict(options, pool_size=1, max_overflow=1))
+        instrument_pool(engine)
+        connections = [engine.connect() for _ in range(2)]
+        with self.assertRaises(PoolTimeoutError):
+            engine.connect()
+
+        metrics = get_pool_metrics(engine)
+        self.assertEqual(metrics['checkouts'], 2)
+        self.assertEqual(metrics['inUse'], 2)
+        self.assertEqual(metrics['overflows'], 1)
+        self.assertEqual(metrics['overflowOpen'], 1)
+        self.assertEqual(metrics['timeouts'], 1)
+        for connection in connections:
+            connection.close()
+        engine.dispose()
+        engine.connect().close()
+        metrics = get_pool_metrics(engine)
+        self.assertEqual((metrics['checkouts'], metrics['inUse']), (3, 0))
+        self.assertEqual((metrics['overflows'], metrics['overflowOpen']),
+                         (1, 0))
+
+        with self.app.test_request_context():
+            res = self.app.make_response(self.app.handle_user_exception(
+                PoolTimeoutError('QueuePool limit reached')))
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_replica_routing(self):
+        """Verifies GETs read from a replica unless the client just wrote."""
+        # The test DB doubles as the replica, through an engine of its own
+        setup_replicas(self.app, [self.database_path])
+        self.addCleanup(setup_replicas, self.app, [])
+        router = self.app.extensions['db_router']
+        statements = []
+        event.listen(router.engines['replica0'], 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+        reader = {'Authorization': 'Bearer reader'}
+        writer = {'Authorization': 'Bearer writer'}
+
+        res = self.client().get('/api/actors?page=2', headers=reader)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(statements)
+
+        res = self.client().post('/api/actors', json=self.actor_request,
+                                 headers=writer)
+        self.assertEqual(res.status_code, 201)
+        actor_id = json.loads(res.data)['created']
+        self.addCleanup(self.client().delete, '/api/actors/%d' % actor_id)
+        statements.clear()
+        res = self.client().get('/api/actors/%d' % actor_id, headers=writer)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+
+        # Reads by other clients right after a write are not cached
+        for _ in range(2):
+            res = self.client().get('/api/actors?per_page=7', headers=reader)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertTrue(statements)
+
+        statements.clear()
+        router.lags['replica0'] = (router.max_lag + 1, time.monotonic())
+        res = self.client().get('/api/actors?page=3', headers=reader)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+
+        res_body = json.loads(self.client().get('/api/metrics').data)
+        self.assertEqual(res_body['dbReplicas']['replicaReads'], 3)
+        self.assertEqual(res_body['dbReplicas']['lagFallbacks'], 1)
+
+    def test_app_factory(self):
+        """Verifies the app is only built by create_app, from its config."""
+        self.assertFalse(hasattr(app_module, 'app'))
+        self.assertEqual(auth.API_AUDIENCE, self.app.config['API_AUDIENCE'])
+        self.assertEqual(auth.jwks_cache.ttl, self.app.config['JWKS_TTL'])
+        self.assertEqual(auth.token_cache.max_entries,
+                         self.app.config['JWT_CACHE_SIZE'])
+        self.assertTrue(self.app.config['DB_CREATE_SCHEMA'])
+        self.assertFalse(ProductionConfig.DB_CREATE_SCHEMA)
+
+    def test_unit_of_work(self):
+        """Verifies writes commit once when the request ends, if at all."""
+        committed = []
+        listener = after_commit(lambda changes: committed.append(
+            sorted(change.row['name'] for change in changes
+                   if change.table == 'actor')))
+        self.addCleanup(models._commit_listeners.remove, listener)
+
+        def count(name):
+            return Actor.query.filter_by(name=name).count()
+
+        def create_actor(name):
+            Actor(name=name, age=30, gender='F').insert()
+
+        for status in (201, 422):
+            with self.app.test_request_context(
+                    '/api/actors', method='POST'):
+                self.app.preprocess_request()
+                commits = len(committed)
+                create_actor('Unit %d A' % status)
+                with self.assertRaises(ValueError):
+                    with savepoint():
+                        create_actor('Unit %d B' % status)
+                        raise ValueError()
+                create_actor('Unit %d C' % status)
+                self.assertEqual(len(committed), commits)
+                self.app.process_response(
+                    self.app.response_class(status=status))
+
+        self.assertEqual(committed, [['Unit 201 A', 'Unit 201 C']])
+        self.assertEqual([count('Unit 201 ' + suffix) for suffix in 'ABC'],
+                         [1, 0, 1])
+        self.assertEqual([count('Unit 422 ' + suffix) for suffix in 'ABC'],
+                         [0, 0, 0])
+
+        with self.app.test_request_context('/api/actors', method='POST'):
+            self.app.preprocess_request()
+            commit_immediately(create_actor)('Unit immediate')
+            self.assertEqual(committed[-1], ['Unit immediate'])
+            self.app.process_response(self.app.response_class(status=500))
+        self.assertEqual(count('Unit immediate'), 1)
+
+        def time_out(session):
+            raise PoolTimeoutError('QueuePool limit reached')
+
+        event.listen(db.session, 'before_commit', time_out)
+        try:
+            res = self.client().post('/api/actors', json=dict(
+                self.actor_request, name='Unit timeout'))
+        finally:
+            event.remove(db.session, 'before_commit', time_out)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(count('Unit timeout'), 0)
+
+    def test_serving(self):
+        """Verifies the gunicorn profiles and what workers share."""
+        environ = dict(os.environ)
+        self.addCleanup(os.environ.update, environ)
+        settings = {}
+        for profile in ('gthread', 'sync'):
+            os.environ.update(GUNICORN_PROFILE=profile, WEB_CONCURRENCY='3')
+            settings[profile] = runpy.run_path('gunicorn.conf.py')
+        self.assertEqual(settings['gthread']['worker_class'], 'gthread')
+        self.assertEqual(settings['gthread']['threads'], 4)
+        self.assertEqual(settings['sync']['worker_class'], 'sync')
+        self.assertEqual(settings['sync']['workers'], 3)
+        self.assertTrue(settings['sync']['preload_app'])
+        os.environ['GUNICORN_PROFILE'] = 'eventlet'
+        with self.assertRaises(ValueError):
+            runpy.run_path('gunicorn.conf.py')
+
+        caches = []
+
+        def create_cache():
+            with self.app.app_context():
+                caches.append(get_cache())
+
+        self.app.extensions.pop('response_cache', None)
+        threads = [threading.Thread(target=create_cache) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, caches))), 1)
+
+        with self.app.app_context():
+            pool = db.engine.pool
+            dispose_engines(self.app)
+            self.assertIsNot(db.engine.pool, pool)
+            self.assertTrue(Actor.query.count())
+
     def test_actors_post_400(self):
         """Verifies the /api/actors endpoint for POST with 400 error."""
         res = self.client().post('/api/actors',
@@ -274,6 +1349,35 @@ class CastingAgencyTestCase(unittest.TestCase):
         res = self.client().get('/api/movies?page=9000')
         self.assertEqual(res.status_code, 404)
 
+    def test_get_actors_per_page_400(self):
+        """Verifies the /api/actors endpoint for GET with 400 error."""
+        res = self.client().get('/api/actors?per_page=9000')
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_movies_cursor_400(self):
+        """Verifies the /api/movies endpoint for GET with a bad cursor."""
+        res = self.client().get('/api/movies?cursor=not-a-cursor')
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().get('/api/movies?sort=gender')
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().get('/api/movies?sort=--title')
+        self.assertEqual(res.status_code, 400)
+
+        for cursor in [['actor', 'name', {'a': 1}, 1],
+                       ['actor', 'name', 'Actor', '1'],
+                       ['actor', 'age', '30', 1]]:
+            res = self.client().get('/api/actors?sort=%s&cursor=%s' % (
+                cursor[1], urlsafe_b64encode(json.dumps(cursor).encode())
+                .decode()))
+            self.assertEqual(res.status_code, 400, cursor)
+
+    def test_search_400(self):
+        """Verifies the /api/search endpoint for GET with 400 error."""
+        res = self.client().get('/api/search?q=')
+        self.assertEqual(res.status_code, 400)
+
     def test_get_actor_404(self):
         """Verifies the /api/actors/<actor_id> endpoint for GET 404 error."""
         res = self.client().get('/api/actors/9000')
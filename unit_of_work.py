@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from functools import wraps
+from flask import request, current_app
+
+from models import db
+
+# Requests whose changes are committed once, when they end
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def begin_unit_of_work():
+    """Defers the commits of a write request to the end of the request."""
+    if request.method in WRITE_METHODS:
+        db.session.info['unit_of_work'] = True
+
+
+def end_unit_of_work(response):
+    """Commits the changes of a request, or rolls them back on an error.
+
+    The changes are rolled back when the response is an error, including
+    the responses of the errorhandlers for aborts and exceptions. If the
+    commit itself fails, the exception is passed to the errorhandlers
+    like one raised by the handler, e.g. a pool timeout answers 503.
+    Flask would otherwise turn any exception raised here into a 500.
+    """
+    if not db.session.info.pop('unit_of_work', False):
+        return response
+
+    if response.status_code >= 400:
+        db.session.rollback()
+        return response
+
+    try:
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        # Re-raises the error if no errorhandler is registered for it
+        return current_app.make_response(
+            current_app.handle_user_exception(error))
+    return response
+
+
+@contextmanager
+def savepoint():
+    """Runs a block of a handler in a nested transaction.
+
+    If the block raises, only the changes it made are rolled back before
+    the exception propagates, so the handler may catch it and carry on
+    with the rest of its unit of work.
+    """
+    with db.session.begin_nested():
+        yield
+
+
+def commit_immediately(f):
+    """Decorator for a handler whose writes must commit as they are made.
+
+    Model insert(), update() and delete() then commit straight away, as
+    they do outside of a request.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        db.session.info.pop('unit_of_work', None)
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def setup_unit_of_work(app):
+    """Commits the changes of each write request of an app once."""
+    app.before_request(begin_unit_of_work)
+    app.after_request(end_unit_of_work)
@@ -0,0 +1,4 @@
+"""Entry point for WSGI servers and `flask db`, e.g. `gunicorn wsgi:app`"""
+from app import create_app
+
+app = create_app()